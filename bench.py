@@ -0,0 +1,242 @@
+"""디스코드 연결 없이 슬래시 명령어를 부하 테스트합니다.
+
+test.py의 실제 명령어 코루틴을 가짜 Interaction 객체로 호출하며,
+매번 새로 만든 임시 DB를 사용하므로 data.db는 건드리지 않습니다.
+
+    python bench.py --users 200 --rounds 20
+    python bench.py --users 500 --api-latency-ms 50 --keep-cooldowns
+    DB_PARTITIONS=4 python bench.py --users 1000 --guilds 8
+"""
+import argparse
+import asyncio
+import importlib.util
+import os
+import random
+import statistics
+import tempfile
+import time
+from collections import defaultdict
+
+BOT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test.py")
+
+
+def load_bot(db_path):
+    # DB_FILE은 모듈이 로드될 때 읽으므로 먼저 환경변수를 바꿔 둠
+    os.environ["DB_FILE"] = db_path
+    spec = importlib.util.spec_from_file_location("distagram_bot", BOT_FILE)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# --- 가짜 디스코드 객체 ---
+class FakePermissions:
+    def __init__(self, administrator=False):
+        self.administrator = administrator
+        self.kick_members = administrator
+        self.ban_members = administrator
+        self.manage_messages = administrator
+
+
+class FakeUser:
+    def __init__(self, user_id, administrator=False):
+        self.id = user_id
+        self.name = f"user{user_id}"
+        self.nick = None
+        self.mention = f"<@{user_id}>"
+        self.guild_permissions = FakePermissions(administrator)
+
+
+class FakeGuild:
+    def __init__(self, guild_id=1, owner_id=0):
+        self.id = guild_id
+        self.owner_id = owner_id
+
+
+class FakeAPI:
+    """디스코드 API 호출 대신 api_latency 만큼 기다리기만 합니다."""
+
+    def __init__(self, api_latency):
+        self.api_latency = api_latency
+        self.calls = 0
+
+    async def call(self):
+        self.calls += 1
+        await asyncio.sleep(self.api_latency)
+
+
+class FakeResponse:
+    def __init__(self, api):
+        self.api = api
+
+    async def send_message(self, *args, **kwargs):
+        await self.api.call()
+
+    async def defer(self, *args, **kwargs):
+        await self.api.call()
+
+    async def edit_message(self, *args, **kwargs):
+        await self.api.call()
+
+
+class FakeFollowup:
+    def __init__(self, api):
+        self.api = api
+
+    async def send(self, *args, **kwargs):
+        await self.api.call()
+
+
+class FakeChannel:
+    def __init__(self, api):
+        self.api = api
+
+    async def send(self, *args, **kwargs):
+        await self.api.call()
+
+
+class FakeInteraction:
+    def __init__(self, user, guild, api):
+        self.user = user
+        self.guild = guild
+        self.guild_id = guild.id
+        self.channel = FakeChannel(api)
+        self.response = FakeResponse(api)
+        self.followup = FakeFollowup(api)
+
+
+# --- 이벤트 루프 지연 측정 ---
+class LoopMonitor:
+    """interval마다 깨어나서 예정보다 늦게 깨어난 시간(루프가 막힌 시간)의 최댓값을 기록합니다."""
+
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.max_block = 0.0
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.max_block = max(self.max_block, loop.time() - start - self.interval)
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self):
+        self._task.cancel()
+
+
+# --- 시나리오 ---
+def command_mix(bot):
+    """(이름, 가중치, 호출 함수) 목록. 호출 함수는 interaction을 받아 코루틴을 반환합니다."""
+    return [
+        ("출석", 10, lambda i: bot.출석.callback(i)),
+        ("게시물올리기", 30, lambda i: bot.게시물올리기.callback(i, 내용=None)),
+        ("이벤트", 20, lambda i: bot.이벤트.callback(i)),
+        ("내피드", 15, lambda i: bot.내피드.callback(i)),
+        ("잔액", 15, lambda i: bot.잔액.callback(i)),
+        ("타임라인", 10, lambda i: bot.타임라인.callback(i)),
+        ("잔액랭킹", 5, lambda i: bot.잔액랭킹.callback(i)),
+        ("랭킹", 5, lambda i: bot.랭킹.callback(i, 종류=random.choice(list(bot.RANKING_STATS)))),
+    ]
+
+
+async def simulate_user(user_id, rounds, mix, guild, api, latencies):
+    interaction = FakeInteraction(FakeUser(user_id), guild, api)
+    names = [name for name, _, _ in mix]
+    weights = [weight for _, weight, _ in mix]
+    calls = {name: call for name, _, call in mix}
+    for _ in range(rounds):
+        name = random.choices(names, weights=weights, k=1)[0]
+        start = time.perf_counter()
+        await calls[name](interaction)
+        latencies[name].append(time.perf_counter() - start)
+
+
+async def run(args):
+    tmp = tempfile.TemporaryDirectory()
+    bot = load_bot(os.path.join(tmp.name, "bench.db"))
+    bot.init_storage()
+    if not args.keep_cooldowns:
+        # 쿨타임에 걸리면 DB까지 가지 않으므로 기본값은 쿨타임 없이 측정
+        for partition in bot.partitions:
+            partition.cooldowns.config = {command: 0 for command in partition.cooldowns.config}
+
+    api = FakeAPI(args.api_latency_ms / 1000)
+    # 샤드 번호 공식((id >> 22) % 개수)에 맞춰 서버마다 다른 파티션에 가도록 ID를 만듦
+    guilds = [FakeGuild(guild_id=(i + 1) << 22) for i in range(args.guilds)]
+    user_ids = list(range(1, args.users + 1))
+    for user_id in user_ids:
+        await bot.가입.callback(FakeInteraction(FakeUser(user_id), guilds[user_id % len(guilds)], api))
+    # 같은 서버 유저끼리 --follows명씩 팔로우 (1번 유저는 모두가 팔로우하는 인기 계정)
+    for user_id in user_ids:
+        guild = guilds[user_id % len(guilds)]
+        same_guild = [other for other in user_ids if other % len(guilds) == user_id % len(guilds) and other != user_id]
+        targets = random.sample(same_guild, min(args.follows, len(same_guild)))
+        if user_id != 1 and guild is guilds[1 % len(guilds)]:
+            targets = set(targets) | {1}
+        for target in targets:
+            await bot.팔로우.callback(FakeInteraction(FakeUser(user_id), guild, api), 유저=FakeUser(target))
+
+    mix = command_mix(bot)
+    latencies = defaultdict(list)
+    monitor = LoopMonitor()
+    monitor.start()
+    flush_task = asyncio.get_running_loop().create_task(bot.flush_loop())
+
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        simulate_user(user_id, args.rounds, mix, guilds[user_id % len(guilds)], api, latencies)
+        for user_id in user_ids
+    ))
+    elapsed = time.perf_counter() - start
+
+    flush_task.cancel()
+    monitor.stop()
+    await bot.flush_all()
+    bot.close_storage()
+    tmp.cleanup()
+    return latencies, elapsed, monitor.max_block
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * pct / 100), len(ordered) - 1)]
+
+
+def report(latencies, elapsed, max_block, args):
+    total = sum(len(v) for v in latencies.values())
+    print(f"유저 {args.users}명 x {args.rounds}회, 서버 {args.guilds}개, API 지연 {args.api_latency_ms}ms, "
+          f"쿨타임 {'켜짐' if args.keep_cooldowns else '꺼짐'}")
+    print(f"{'명령어':<10}{'횟수':>8}{'p50(ms)':>10}{'p99(ms)':>10}{'max(ms)':>10}")
+    for name, values in sorted(latencies.items()):
+        print(f"{name:<10}{len(values):>8}{percentile(values, 50) * 1000:>10.2f}"
+              f"{percentile(values, 99) * 1000:>10.2f}{max(values) * 1000:>10.2f}")
+    every = [v for values in latencies.values() for v in values]
+    print(f"{'전체':<10}{total:>8}{percentile(every, 50) * 1000:>10.2f}"
+          f"{percentile(every, 99) * 1000:>10.2f}{max(every) * 1000:>10.2f}")
+    print(f"처리량: {total / elapsed:,.0f} 명령/초 ({elapsed:.2f}초)")
+    print(f"평균 지연: {statistics.mean(every) * 1000:.2f}ms")
+    print(f"이벤트 루프 최대 멈춤: {max_block * 1000:.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="디스타그램 명령어 부하 테스트")
+    parser.add_argument("--users", type=int, default=100, help="동시에 명령어를 보내는 유저 수")
+    parser.add_argument("--guilds", type=int, default=1, help="유저를 나눠 담을 서버 수")
+    parser.add_argument("--rounds", type=int, default=20, help="유저마다 보내는 명령어 수")
+    parser.add_argument("--follows", type=int, default=10, help="유저마다 팔로우하는 유저 수")
+    parser.add_argument("--api-latency-ms", type=float, default=0, help="가짜 디스코드 API 응답 지연")
+    parser.add_argument("--keep-cooldowns", action="store_true", help="명령어 쿨타임을 그대로 적용")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    latencies, elapsed, max_block = asyncio.run(run(args))
+    report(latencies, elapsed, max_block, args)
+
+
+if __name__ == "__main__":
+    main()
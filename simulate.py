@@ -0,0 +1,133 @@
+"""이벤트/게시물 결과 표로 몇 달치 유저 스탯이 어떻게 퍼지는지 오프라인으로 시뮬레이션합니다.
+
+봇과 같은 events.json을 test.py의 load_game_config로 읽고 검사하며,
+뽑기는 봇이 쓰는 alias 표(prob, alias)를 NumPy로 한꺼번에 돌립니다.
+DB나 디스코드에는 연결하지 않습니다.
+
+    python simulate.py --users 100000 --days 90
+    python simulate.py --config my_events.json --posts-per-day 10 --events-per-day 5
+"""
+import argparse
+import importlib.util
+import os
+import time
+
+import numpy as np
+
+BOT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test.py")
+
+
+def load_bot():
+    spec = importlib.util.spec_from_file_location("distagram_bot", BOT_FILE)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class Table:
+    """결과 표 하나를 NumPy 배열로: 스탯 변화량 행렬과 alias 표"""
+
+    def __init__(self, entries, sampler, stats):
+        self.names = [entry["name"] for entry in entries]
+        self.deltas = np.array([[entry["deltas"].get(col, 0) for col in stats] for entry in entries], dtype=np.int64)
+        self.prob = np.array(sampler.prob)
+        self.alias = np.array(sampler.alias)
+        weights = np.array([entry["weight"] for entry in entries])
+        self.p = weights / weights.sum()
+
+    def sample(self, rng, size):
+        """AliasSampler.sample과 같은 방법으로 size개를 한 번에 뽑아 번호를 반환합니다."""
+        i = rng.integers(len(self.names), size=size)
+        return np.where(rng.random(size) < self.prob[i], i, self.alias[i])
+
+
+def feed_titles(bot, stats, values):
+    """유저마다 /내피드 칭호 번호 (FEED_TITLES 순서, 마지막은 기본 칭호)"""
+    conditions = [values[:, stats.index(col)] >= threshold for col, threshold, _ in bot.FEED_TITLES]
+    return np.select(conditions, np.arange(len(conditions)), default=len(conditions))
+
+
+def simulate(bot, config, args, rng):
+    stats = bot.GAME_STATS
+    posts = Table(config.posts, config.post_sampler, stats)
+    events = Table(config.events, config.event_sampler, stats)
+    resets = np.array([event["reset"] for event in config.events])
+
+    values = np.zeros((args.users, len(stats)), dtype=np.int64)
+    event_counts = np.zeros(len(events.names), dtype=np.int64)
+    wiped = np.zeros(args.users, dtype=bool)
+    checkpoints = []
+
+    for day in range(1, args.days + 1):
+        active = rng.random(args.users) < args.active
+        # 게시물은 순서와 상관없이 더하기만 하므로 결과별 횟수를 한 번에 뽑음
+        counts = rng.multinomial(args.posts_per_day, posts.p, size=args.users) * active[:, None]
+        values += counts @ posts.deltas
+        # 이벤트는 계정 해킹(reset)이 순서에 영향을 주므로 하루 횟수만큼 차례로
+        for _ in range(args.events_per_day):
+            picked = events.sample(rng, args.users)
+            picked_active = picked[active]
+            event_counts += np.bincount(picked_active, minlength=len(events.names))
+            values[active] += events.deltas[picked_active]
+            reset = active & resets[picked]
+            values[reset] = 0
+            wiped |= reset
+        if day % args.report_every == 0 or day == args.days:
+            checkpoints.append((day, np.bincount(feed_titles(bot, stats, values), minlength=len(bot.FEED_TITLES) + 1)))
+
+    return values, event_counts, wiped, checkpoints, events
+
+
+def report(bot, args, values, event_counts, wiped, checkpoints, events, elapsed):
+    stats = bot.GAME_STATS
+    user_days = args.users * args.days
+    print(f"유저 {args.users:,}명 x {args.days}일 = {user_days:,} 유저-일 "
+          f"(활동 확률 {args.active:.0%}, 하루 게시물 {args.posts_per_day}회 · 이벤트 {args.events_per_day}회)")
+    print(f"계산 시간 {elapsed:.2f}초 ({user_days / elapsed:,.0f} 유저-일/초)")
+
+    percentiles = [1, 10, 50, 90, 99, 99.9]
+    print()
+    print(f"{'스탯':<10}" + "".join(f"{f'p{p}':>10}" for p in percentiles) + f"{'최대':>10}{'평균':>10}")
+    for n, col in enumerate(stats):
+        column = values[:, n]
+        print(f"{col:<10}" + "".join(f"{v:>10,.0f}" for v in np.percentile(column, percentiles))
+              + f"{column.max():>10,}{column.mean():>10,.1f}")
+
+    print()
+    print("이벤트 발생 횟수 (기대 비율 대비)")
+    total = event_counts.sum()
+    for n, name in enumerate(events.names):
+        print(f"  {name:<24}{event_counts[n]:>12,}  {event_counts[n] / max(total, 1):>8.3%}  (기대 {events.p[n]:.3%})")
+    print(f"  계정이 한 번이라도 초기화된 유저: {wiped.mean():.2%}")
+
+    titles = [title for _, _, title in bot.FEED_TITLES] + [bot.DEFAULT_FEED_TITLE]
+    print()
+    print(f"{'칭호 분포':<14}" + "".join(f"{f'{day}일':>10}" for day, _ in checkpoints))
+    for n, title in enumerate(titles):
+        print(f"{title:<14}" + "".join(f"{counts[n] / args.users:>10.2%}" for _, counts in checkpoints))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="디스타그램 이벤트/게시물 밸런스 시뮬레이터")
+    parser.add_argument("--users", type=int, default=100000, help="시뮬레이션할 유저 수")
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--active", type=float, default=0.7, help="유저가 하루에 접속할 확률")
+    parser.add_argument("--posts-per-day", type=int, default=5, help="접속한 날 /게시물올리기 횟수")
+    parser.add_argument("--events-per-day", type=int, default=3, help="접속한 날 /이벤트 횟수")
+    parser.add_argument("--report-every", type=int, default=30, help="칭호 분포를 기록할 간격 (일)")
+    parser.add_argument("--config", default=None, help="events.json 대신 검사할 결과 표 파일")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    bot = load_bot()
+    config = bot.load_game_config(args.config) if args.config else bot.game_config
+    rng = np.random.default_rng(args.seed)
+
+    start = time.perf_counter()
+    values, event_counts, wiped, checkpoints, events = simulate(bot, config, args, rng)
+    elapsed = time.perf_counter() - start
+    report(bot, args, values, event_counts, wiped, checkpoints, events, elapsed)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,8 @@
+import time
+STARTED_AT = time.monotonic()  # import에 걸리는 시간까지 재기 위해 가장 먼저
+
 import nextcord
+import aiohttp
 from nextcord.ext import commands
 from nextcord import Interaction
 import sqlite3
@@ -6,8 +10,45 @@ from datetime import datetime, timedelta
 import random
 import openpyxl
 import os
+import sys
 from dotenv import load_dotenv
 import asyncio
+import tempfile
+import contextvars
+import functools
+import json
+import re
+from collections import OrderedDict, defaultdict, deque
+import bisect
+import heapq
+import hashlib
+import gzip
+import shutil
+import signal
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+try:
+    import resource  # 윈도우에는 없음
+except ImportError:
+    resource = None
+
+
+# --- 시작 시간 측정 ---
+startup_steps = {}  # 단계 이름 -> 걸린 시간 (초), 기록한 순서대로
+_last_step_at = STARTED_AT
+
+
+def startup_step(name):
+    """직전 단계가 끝난 뒤부터 지금까지를 name 단계로 기록합니다. 재연결 때 다시 불려도 처음 값만 남깁니다."""
+    global _last_step_at
+    if name in startup_steps:
+        return
+    now = time.monotonic()
+    startup_steps[name] = now - _last_step_at
+    _last_step_at = now
+
+
+startup_step("import")
 
 intents = nextcord.Intents.default()
 intents.message_content = True
@@ -16,16 +57,122 @@ intents.members = True
 load_dotenv()
 Token = os.getenv("Token")
 
-bot = commands.Bot(command_prefix="!", intents=intents)
-
-DB_FILE = "data.db"
-
-
-# --- DB 초기화 함수 ---
-def init_db():
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("""
+# AUTO_SHARD=1 이면 AutoShardedBot으로 실행 (SHARD_COUNT가 비어 있으면 디스코드가 권장하는 샤드 수)
+AUTO_SHARD = os.getenv("AUTO_SHARD") == "1"
+SHARD_COUNT = int(os.getenv("SHARD_COUNT")) if os.getenv("SHARD_COUNT") else None
+
+# 멤버 캐시 정책
+# "none"(기본): 시작할 때 멤버 목록을 받지 않고, 필요한 멤버만 그때그때 가져와 잠깐 보관 (MemberCache)
+# "all": 시작할 때 모든 서버의 멤버 목록을 받아 전부 메모리에 둠
+MEMBER_CACHE = os.getenv("MEMBER_CACHE", "none")
+MEMBER_CACHE_SIZE = 1000  # "none"일 때 보관할 멤버 수
+MEMBER_CACHE_TTL = 5 * 60  # 가져온 멤버 정보를 믿는 시간 (초)
+
+bot_options = dict(
+    command_prefix="!",
+    intents=intents,
+    chunk_guilds_at_startup=MEMBER_CACHE == "all",
+    member_cache_flags=(nextcord.MemberCacheFlags.from_intents(intents) if MEMBER_CACHE == "all"
+                        else nextcord.MemberCacheFlags.none()),
+)
+if AUTO_SHARD:
+    bot = commands.AutoShardedBot(shard_count=SHARD_COUNT, **bot_options)
+else:
+    bot = commands.Bot(**bot_options)
+
+DB_FILE = os.getenv("DB_FILE", "data.db")
+# 서버별 데이터를 나눠 담을 DB 파일 수. 샤드 번호와 같은 공식으로 나누므로
+# SHARD_COUNT와 같게 두면 샤드마다 자기 DB 파일과 DB 스레드를 가집니다.
+DB_PARTITIONS = int(os.getenv("DB_PARTITIONS", "1"))
+LEGACY_GUILD_ID = os.getenv("LEGACY_GUILD_ID", "")  # 서버별로 나누기 전에 쌓인 데이터의 서버 ID
+# 연결마다 적용하는 설정: WAL은 읽기와 쓰기가 서로 막지 않고,
+# WAL에서는 synchronous=NORMAL 이어도 전원이 꺼지지 않는 한 커밋이 유실되지 않음
+DB_PRAGMAS = [
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-20000",  # 페이지 캐시 약 20MB
+    "PRAGMA temp_store=MEMORY",
+]
+METRICS_FILE = os.getenv("METRICS_FILE", "metrics.prom")  # Prometheus 텍스트 형식 통계 파일
+METRICS_INTERVAL = 15  # 통계 파일을 다시 쓰는 주기 (초)
+LOOP_LAG_INTERVAL = 0.5  # 이벤트 루프 지연 측정 주기 (초)
+COMMAND_HASH_FILE = os.getenv("COMMAND_HASH_FILE", "commands.sha256")  # 마지막으로 동기화한 슬래시 명령어 해시
+ANON_LOG_CHANNEL_ID = 1383790330926858341  # 익명 메시지 로그 채널
+ANON_LOG_FILE = "anonymous_log.jsonl"  # 디스코드 전송과 별개로 남기는 로컬 로그 (한 줄에 하나씩 추가만 함)
+LOG_BATCH_WAIT = 1.0  # 로그를 모아서 보내기 위해 기다리는 시간 (초)
+LOG_MAX_RETRIES = 5
+LEDGER_RETENTION_DAYS = 30  # 이보다 오래된 거래 내역은 유저별 스냅샷으로 합침
+LEDGER_COMPACT_INTERVAL = 60 * 60  # 원장 압축 주기 (초)
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")  # gzip으로 압축한 DB 백업을 두는 폴더
+BACKUP_INTERVAL = 6 * 60 * 60  # 자동 백업 주기 (초)
+BACKUP_KEEP = 28  # DB 파일마다 남겨 둘 백업 수 (오래된 것부터 지움)
+BACKUP_PAGES = 256  # 백업 한 단계에 복사하는 페이지 수 (4KB 페이지면 1MB)
+BACKUP_STEP_SLEEP = 0.01  # 단계 사이에 쉬는 시간 (초) - 디스크를 독차지하지 않도록
+BACKUP_MAX_RESTARTS = 3  # 복사 중 쓰기 때문에 처음부터 다시 시작된 횟수가 이보다 많으면 한 번에 복사
+EXCEL_BATCH_SIZE = 1000  # 엑셀 내보내기/가져오기 시 한 번에 처리하는 행 수
+USER_CACHE_SIZE = 5000  # 메모리에 유지할 유저 행 수
+CACHE_FLUSH_INTERVAL_MS = 500  # 변경된 행을 DB에 모아서 쓰는 주기
+SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", "10"))  # 종료할 때 처리 중인 명령어를 기다리는 최대 시간 (초)
+SHUTDOWN_LOG_TIMEOUT = 5  # 종료할 때 남은 익명 로그를 보내는 최대 시간 (초)
+
+USER_COLUMNS = [
+    "name", "follower", "following", "like", "hate", "balance",
+    "last_post_time", "last_feed_time", "last_event_time", "last_checkin_time",
+]
+# 증감량으로 저장하는 컬럼 (balance = balance + ?), 나머지는 값을 그대로 덮어씀
+COUNTER_COLUMNS = ["follower", "following", "like", "hate", "balance"]
+
+PURGE_MAX = 10000  # /메시지대량삭제 한 번에 지울 수 있는 최대 메시지 수
+PURGE_BATCH_SIZE = 100  # 한 번의 bulk delete로 지울 수 있는 최대 메시지 수
+PURGE_BULK_MAX_AGE = timedelta(days=14, minutes=-5)  # 이보다 오래된 메시지는 bulk delete가 안 되므로 하나씩 (여유 5분)
+PURGE_SINGLE_DELAY = 1.0  # 오래된 메시지를 하나씩 지울 때 간격 (초)
+PURGE_PROGRESS_INTERVAL = 3  # 진행 상황 메시지를 고치는 주기 (초)
+INTERACTION_EDIT_TTL = timedelta(minutes=14)  # 명령어 응답 메시지는 15분까지만 고칠 수 있음 (여유 1분)
+
+TIMELINE_SIZE = 50  # 유저마다 메모리에 유지하는 타임라인 글 수
+TIMELINE_CACHE_USERS = 2000  # 타임라인을 메모리에 유지할 유저 수 (오래 안 본 순서로 버림)
+FANOUT_LIMIT = 1000  # 팔로워가 이보다 많으면 글을 팔로워 타임라인에 넣지 않고 읽을 때 가져옴
+TIMELINE_PAGE_SIZE = 10
+POST_RETENTION_DAYS = 30  # 이보다 오래된 게시물은 지움
+
+LEADERBOARD_SIZE = 50  # 메모리에 유지하는 랭킹 상위 인원
+RANKING_PAGE_SIZE = 10
+RANKING_STATS = {"balance": "잔액", "follower": "팔로워", "like": "좋아요", "hate": "싫어요"}
+
+# 유저별 요청 속도 제한 (토큰 버킷): 초당 RATE_LIMIT_PER_SEC개씩 최대 RATE_LIMIT_BURST개까지 쌓임
+RATE_LIMIT_PER_SEC = float(os.getenv("RATE_LIMIT_PER_SEC", "1"))
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", "5"))
+# 오래 걸리는 관리자 명령어는 그동안 같은 유저의 다른 명령어를 막지 않도록 유저 잠금에서 뺌
+LOCK_EXEMPT_COMMANDS = {"메시지대량삭제", "엑셀내보내기", "엑셀가져오기", "백업"}
+
+# /이벤트, /게시물올리기 결과 표. 코드와 같이 배포하는 설정이라 test.py 옆에서 읽음
+GAME_CONFIG_FILE = os.getenv("GAME_CONFIG_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "events.json"))
+GAME_STATS = ["follower", "following", "like", "hate"]  # 이벤트/게시물이 바꿀 수 있는 스탯
+
+# /내피드 칭호: 위에서부터 처음으로 기준을 넘는 칭호 (스탯, 기준, 칭호)
+FEED_TITLES = [
+    ("follower", 10000, "🎤 연예인"),
+    ("follower", 5000, "🌟 인플루언서"),
+    ("follower", 1000, "🔥 라이징스타"),
+    ("hate", 10000, "💀 혐오유발자"),
+    ("hate", 5000, "🦇 다크나이트"),
+    ("hate", 1000, "💢 불행전달자"),
+]
+DEFAULT_FEED_TITLE = "👤 일반인"
+
+# 명령어별 쿨타임 (초)
+COOLDOWNS = {
+    "게시물올리기": 15,
+    "내피드": 10,
+    "이벤트": 5 * 60,
+}
+
+
+# --- DB 스키마 마이그레이션 ---
+# 적용된 버전은 PRAGMA user_version 에 기록되고, init_db()는 그보다 새 단계만 순서대로 실행합니다.
+# 스키마를 바꿀 때는 기존 함수를 고치지 말고 MIGRATIONS 끝에 새 단계를 추가하세요.
+def _migrate_base(conn):
+    conn.execute("""
     CREATE TABLE IF NOT EXISTS users (
         user_id TEXT PRIMARY KEY,
         name TEXT,
@@ -40,80 +187,2110 @@ def init_db():
         last_checkin_time TEXT
     )
     """)
-    conn.commit()
-    conn.close()
 
 
-# --- 유저 존재 확인 ---
-def user_exists(user_id):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("SELECT 1 FROM users WHERE user_id = ?", (user_id,))
-    exists = c.fetchone() is not None
-    conn.close()
-    return exists
+def _migrate_cooldowns(conn):
+    # 재시작해도 유지되는 쿨타임 (만료 시각은 epoch 초)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS cooldowns (
+        user_id TEXT NOT NULL,
+        command TEXT NOT NULL,
+        expires_at INTEGER NOT NULL,
+        PRIMARY KEY (user_id, command)
+    )
+    """)
+
+
+def _migrate_integer_times(conn):
+    # "%Y-%m-%d %H:%M:%S"(로컬 시각) 문자열 컬럼을 epoch 초 INTEGER 컬럼으로 바꿉니다.
+    # SQLite는 컬럼 타입 변경이 안 되므로 새 테이블로 옮긴 뒤 이름을 바꿉니다.
+    conn.execute("""
+    CREATE TABLE users_new (
+        user_id TEXT PRIMARY KEY,
+        name TEXT,
+        follower INTEGER NOT NULL DEFAULT 0,
+        following INTEGER NOT NULL DEFAULT 0,
+        like INTEGER NOT NULL DEFAULT 0,
+        hate INTEGER NOT NULL DEFAULT 0,
+        balance INTEGER NOT NULL DEFAULT 0,
+        last_post_time INTEGER,
+        last_feed_time INTEGER,
+        last_event_time INTEGER,
+        last_checkin_time INTEGER
+    )
+    """)
+    to_epoch = "CAST(strftime('%s', {0}, 'utc') AS INTEGER)"
+    conn.execute(f"""
+    INSERT INTO users_new
+    SELECT user_id, name,
+           COALESCE(follower, 0), COALESCE(following, 0), COALESCE(like, 0), COALESCE(hate, 0), COALESCE(balance, 0),
+           {to_epoch.format("last_post_time")}, {to_epoch.format("last_feed_time")},
+           {to_epoch.format("last_event_time")}, {to_epoch.format("last_checkin_time")}
+    FROM users
+    """)
+    conn.execute("DROP TABLE users")
+    conn.execute("ALTER TABLE users_new RENAME TO users")
+
+
+def _migrate_indexes(conn):
+    # 랭킹 조회/페이지 넘김용 (ORDER BY col DESC, user_id)
+    for col in RANKING_STATS:
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_users_{col} ON users ({col} DESC, user_id)")
+    # 시작 시 남은 쿨타임 로드, 만료된 쿨타임 정리용
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_cooldowns_expires ON cooldowns (expires_at)")
+
+
+def _migrate_ledger(conn):
+    # 잔액 변경은 ledger에 한 줄씩 추가만 하고, 오래된 줄은 balance_snapshots로 합칩니다.
+    # 항상 users.balance = 스냅샷 잔액 + 남은 ledger 합계
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS ledger (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        amount INTEGER NOT NULL,
+        reason TEXT,
+        actor_id TEXT,
+        created_at INTEGER NOT NULL
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_ledger_user_time ON ledger (user_id, created_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_ledger_time ON ledger (created_at)")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS balance_snapshots (
+        user_id TEXT PRIMARY KEY,
+        balance INTEGER NOT NULL,
+        last_ledger_id INTEGER NOT NULL,
+        as_of INTEGER NOT NULL
+    )
+    """)
+    # 지금까지의 잔액은 내역이 없으니 시작 스냅샷으로
+    conn.execute("""
+    INSERT OR IGNORE INTO balance_snapshots (user_id, balance, last_ledger_id, as_of)
+    SELECT user_id, balance, 0, CAST(strftime('%s', 'now') AS INTEGER) FROM users WHERE balance != 0
+    """)
+
+
+def _migrate_guilds(conn):
+    # 서버마다 따로 경제를 갖도록 모든 키에 guild_id를 붙입니다.
+    # 기존 데이터는 LEGACY_GUILD_ID 서버 것으로 옮기고, 비어 있으면 ''로 두었다가
+    # 봇이 서버 하나에만 있을 때 시작하면서 그 서버로 옮깁니다 (Database.adopt_legacy).
+    legacy = LEGACY_GUILD_ID
+    user_columns = ", ".join(USER_COLUMNS)
+    conn.execute("""
+    CREATE TABLE users_new (
+        guild_id TEXT NOT NULL,
+        user_id TEXT NOT NULL,
+        name TEXT,
+        follower INTEGER NOT NULL DEFAULT 0,
+        following INTEGER NOT NULL DEFAULT 0,
+        like INTEGER NOT NULL DEFAULT 0,
+        hate INTEGER NOT NULL DEFAULT 0,
+        balance INTEGER NOT NULL DEFAULT 0,
+        last_post_time INTEGER,
+        last_feed_time INTEGER,
+        last_event_time INTEGER,
+        last_checkin_time INTEGER,
+        PRIMARY KEY (guild_id, user_id)
+    )
+    """)
+    conn.execute(f"INSERT INTO users_new (guild_id, user_id, {user_columns}) SELECT ?, user_id, {user_columns} FROM users",
+                 (legacy,))
+    conn.execute("DROP TABLE users")
+    conn.execute("ALTER TABLE users_new RENAME TO users")
+
+    conn.execute("""
+    CREATE TABLE cooldowns_new (
+        guild_id TEXT NOT NULL,
+        user_id TEXT NOT NULL,
+        command TEXT NOT NULL,
+        expires_at INTEGER NOT NULL,
+        PRIMARY KEY (guild_id, user_id, command)
+    )
+    """)
+    conn.execute("INSERT INTO cooldowns_new SELECT ?, user_id, command, expires_at FROM cooldowns", (legacy,))
+    conn.execute("DROP TABLE cooldowns")
+    conn.execute("ALTER TABLE cooldowns_new RENAME TO cooldowns")
+
+    conn.execute("""
+    CREATE TABLE balance_snapshots_new (
+        guild_id TEXT NOT NULL,
+        user_id TEXT NOT NULL,
+        balance INTEGER NOT NULL,
+        last_ledger_id INTEGER NOT NULL,
+        as_of INTEGER NOT NULL,
+        PRIMARY KEY (guild_id, user_id)
+    )
+    """)
+    conn.execute("INSERT INTO balance_snapshots_new SELECT ?, user_id, balance, last_ledger_id, as_of FROM balance_snapshots",
+                 (legacy,))
+    conn.execute("DROP TABLE balance_snapshots")
+    conn.execute("ALTER TABLE balance_snapshots_new RENAME TO balance_snapshots")
+
+    # ledger는 id(AUTOINCREMENT)를 유지하기 위해 컬럼만 추가
+    conn.execute("ALTER TABLE ledger ADD COLUMN guild_id TEXT NOT NULL DEFAULT ''")
+    conn.execute("UPDATE ledger SET guild_id = ?", (legacy,))
+    conn.execute("DROP INDEX IF EXISTS idx_ledger_user_time")
+    conn.execute("CREATE INDEX idx_ledger_user_time ON ledger (guild_id, user_id, created_at)")
+
+    for col in RANKING_STATS:
+        conn.execute(f"CREATE INDEX idx_users_{col} ON users (guild_id, {col} DESC, user_id)")
+    conn.execute("CREATE INDEX idx_cooldowns_expires ON cooldowns (expires_at)")
+
+
+def _migrate_follows(conn):
+    # 팔로우 관계. 기본 키로 "내가 팔로우하는 사람"을, 인덱스로 "나를 팔로우하는 사람"을 찾음
+    conn.execute("""
+    CREATE TABLE follows (
+        guild_id TEXT NOT NULL,
+        follower_id TEXT NOT NULL,
+        followee_id TEXT NOT NULL,
+        created_at INTEGER NOT NULL,
+        PRIMARY KEY (guild_id, follower_id, followee_id)
+    ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX idx_follows_followee ON follows (guild_id, followee_id, follower_id)")
+    # 실제 팔로우 수. follows와 같은 트랜잭션에서 1씩 더하고 빼므로 다시 셀 필요가 없음
+    # (users.follower/following은 이벤트로도 바뀌는 게임 스탯이라 따로 둠)
+    conn.execute("""
+    CREATE TABLE follow_counts (
+        guild_id TEXT NOT NULL,
+        user_id TEXT NOT NULL,
+        followers INTEGER NOT NULL DEFAULT 0,
+        following INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (guild_id, user_id)
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE posts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        guild_id TEXT NOT NULL,
+        user_id TEXT NOT NULL,
+        content TEXT NOT NULL,
+        created_at INTEGER NOT NULL
+    )
+    """)
+    conn.execute("CREATE INDEX idx_posts_user ON posts (guild_id, user_id, id)")
+    conn.execute("CREATE INDEX idx_posts_time ON posts (created_at)")
+
+
+def _migrate_custom_replies(conn):
+    # 관리자가 추가하는 !트리거 자동응답. guild_id = '' 는 모든 서버 공통
+    conn.execute("""
+    CREATE TABLE custom_replies (
+        guild_id TEXT NOT NULL,
+        trigger TEXT NOT NULL,
+        reply TEXT NOT NULL,
+        weight REAL NOT NULL DEFAULT 1,
+        PRIMARY KEY (guild_id, trigger, reply)
+    )
+    """)
+    # 예전에 코드에 박혀 있던 명령어들
+    conn.executemany("INSERT INTO custom_replies (guild_id, trigger, reply) VALUES ('', ?, ?)", [
+        ("수빈", "서버 내 최강 미녀"),
+        ("인천나얼", "서버 내 핵심인재"),
+        ("레인", "레인공쥬등장"),
+        ("봄", "봄이는 수비니를 조아해"),
+        ("어서오세요", "반가워요"),
+        ("어서오세요", "환영해요"),
+        ("어서오세요", "음챗해요"),
+        ("어서오세요", "게임해요"),
+    ])
+
+
+def _migrate_meta(conn):
+    # DB 파일마다 값 하나씩인 정보 (journal_seq: 저장이 끝난 마지막 저널 번호)
+    conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+
+
+MIGRATIONS = [
+    _migrate_base,
+    _migrate_cooldowns,
+    _migrate_integer_times,
+    _migrate_indexes,
+    _migrate_ledger,
+    _migrate_guilds,
+    _migrate_follows,
+    _migrate_custom_replies,
+    _migrate_meta,
+]
 
 
-# --- 유저 추가 (가입) ---
-def add_user(user_id, name):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("INSERT OR IGNORE INTO users (user_id, name) VALUES (?, ?)", (user_id, name))
-    conn.commit()
+# --- DB 초기화 함수 ---
+def init_db(path=DB_FILE):
+    conn = sqlite3.connect(path, isolation_level=None)  # 트랜잭션은 직접 관리
+    conn.execute("PRAGMA journal_mode=WAL")
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, migrate in enumerate(MIGRATIONS[version:], start=version + 1):
+        # 단계마다 하나의 트랜잭션: 중간에 실패하면 그 단계 전체가 취소되고 버전도 그대로
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            migrate(conn)
+            conn.execute(f"PRAGMA user_version = {number}")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        print(f"DB 마이그레이션 {number} 적용 ({path}): {migrate.__name__}")
     conn.close()
 
 
-# --- 쿨타임 체크 함수 ---
-def is_on_cooldown(last_time_str, cooldown_minutes):
-    if last_time_str is None:
-        return False, 0
+# --- 성능 통계 ---
+# 명령어마다 전체 처리 시간, 그중 DB를 기다린 시간, 디스코드 API를 기다린 시간을 히스토그램으로 모읍니다.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 마지막 칸은 +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """구간 안에서 선형 보간한 근사 분위수 (Prometheus histogram_quantile과 같은 방식)"""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        cumulative = 0
+        for i, n in enumerate(self.counts):
+            if cumulative + n >= target:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i else 0.0
+                return lower + (self.buckets[i] - lower) * (target - cumulative) / n
+            cumulative += n
+        return self.buckets[-1]
+
+    def prometheus(self, name, labels=""):
+        sep = "," if labels else ""
+        lines = []
+        cumulative = 0
+        for bound, n in zip(self.buckets, self.counts):
+            cumulative += n
+            lines.append(f'{name}_bucket{{{labels}{sep}le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels}{sep}le="+Inf"}} {self.count}')
+        plain = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{plain} {self.sum}")
+        lines.append(f"{name}_count{plain} {self.count}")
+        return lines
+
+
+class CommandTiming:
+    __slots__ = ("start", "db", "api")
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.db = 0.0
+        self.api = 0.0
+
+
+# 지금 실행 중인 명령어의 CommandTiming (명령어 밖에서는 None)
+command_timing = contextvars.ContextVar("command_timing", default=None)
+
+
+class Metrics:
+    def __init__(self):
+        self.latency = defaultdict(Histogram)
+        self.db_time = defaultdict(Histogram)
+        self.api_time = defaultdict(Histogram)
+        self.errors = defaultdict(int)
+        self.loop_lag = Histogram((0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1))
+        self.loop_lag_max = 0.0
+
+    def record(self, command, timing):
+        self.latency[command].observe(time.perf_counter() - timing.start)
+        self.db_time[command].observe(timing.db)
+        self.api_time[command].observe(timing.api)
+
+    def prometheus(self):
+        lines = []
+        for name, help_text, table in (
+            ("distagram_command_seconds", "명령어 전체 처리 시간", self.latency),
+            ("distagram_command_db_seconds", "명령어가 DB를 기다린 시간", self.db_time),
+            ("distagram_command_api_seconds", "명령어가 디스코드 API를 기다린 시간", self.api_time),
+        ):
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+            for command, histogram in sorted(table.items()):
+                lines += histogram.prometheus(name, f'command="{command}"')
+        lines += ["# HELP distagram_command_errors_total 명령어 오류 수", "# TYPE distagram_command_errors_total counter"]
+        lines += [f'distagram_command_errors_total{{command="{c}"}} {n}' for c, n in sorted(self.errors.items())]
+        lines += ["# HELP distagram_event_loop_lag_seconds 이벤트 루프 지연", "# TYPE distagram_event_loop_lag_seconds histogram"]
+        lines += self.loop_lag.prometheus("distagram_event_loop_lag_seconds")
+        lines += ["# TYPE distagram_event_loop_lag_max_seconds gauge",
+                  f"distagram_event_loop_lag_max_seconds {self.loop_lag_max}"]
+        return "\n".join(lines) + "\n"
+
+    def write_file(self, path=METRICS_FILE):
+        # 읽는 쪽이 반쯤 쓰인 파일을 보지 않도록 임시 파일에 쓰고 교체
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.prometheus())
+        os.replace(tmp_path, path)
+
+
+metrics = Metrics()
+
+
+def track_api_time(cls, name):
+    """디스코드 API 메서드를 감싸서 걸린 시간을 실행 중인 명령어의 API 시간에 더합니다."""
+    original = getattr(cls, name)
+
+    @functools.wraps(original)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await original(*args, **kwargs)
+        finally:
+            timing = command_timing.get()
+            if timing is not None:
+                timing.api += time.perf_counter() - start
+
+    setattr(cls, name, wrapper)
+
+
+for _cls, _name in [
+    (nextcord.InteractionResponse, "send_message"),
+    (nextcord.InteractionResponse, "defer"),
+    (nextcord.InteractionResponse, "edit_message"),
+    (nextcord.Webhook, "send"),  # interaction.followup
+    (nextcord.abc.Messageable, "send"),  # 채널에 직접 보내는 메시지
+]:
+    track_api_time(_cls, _name)
+
+
+# --- 유저별 동시 실행 제한과 요청 속도 제한 ---
+class UserLocks:
+    """유저마다 asyncio.Lock 하나를 두어 같은 유저의 명령어는 차례로, 다른 유저끼리는 동시에 실행합니다.
+    잠금은 실행 중이거나 기다리는 명령어가 들고 있는 동안만 남고, 아무도 안 쓰면 저절로 사라집니다."""
+
+    def __init__(self):
+        self._locks = weakref.WeakValueDictionary()  # user_id -> asyncio.Lock
+
+    def __len__(self):
+        return len(self._locks)
+
+    def get(self, user_id):
+        lock = self._locks.get(user_id)
+        if lock is None:
+            lock = self._locks[user_id] = asyncio.Lock()
+        return lock
+
+
+class RateLimiter:
+    """유저마다 토큰 버킷. 초당 rate개씩 최대 burst개까지 쌓이고 명령어 하나에 하나씩 씁니다.
+    가득 찬 버킷은 없는 것과 같으므로 주기적으로 지워 메모리가 늘지 않게 합니다."""
+    SWEEP_INTERVAL = 60
+
+    def __init__(self, rate=RATE_LIMIT_PER_SEC, burst=RATE_LIMIT_BURST):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}  # user_id -> (남은 토큰, 마지막 갱신 시각)
+        self._next_sweep = 0.0
+        self.rejected = 0
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def _tokens(self, user_id, now):
+        tokens, updated = self._buckets.get(user_id, (self.burst, now))
+        return min(self.burst, tokens + (now - updated) * self.rate)
+
+    def hit(self, user_id, now=None):
+        """토큰이 있으면 하나 쓰고 0을, 없으면 다음 토큰까지 남은 초를 반환합니다."""
+        now = time.monotonic() if now is None else now
+        if now >= self._next_sweep:
+            self._sweep(now)
+        tokens = self._tokens(user_id, now)
+        if tokens < 1:
+            self._buckets[user_id] = (tokens, now)
+            self.rejected += 1
+            return (1 - tokens) / self.rate
+        self._buckets[user_id] = (tokens - 1, now)
+        return 0
+
+    def _sweep(self, now):
+        self._next_sweep = now + self.SWEEP_INTERVAL
+        for user_id in [uid for uid in self._buckets if self._tokens(uid, now) >= self.burst]:
+            del self._buckets[user_id]
+
+
+user_locks = UserLocks()
+rate_limiter = RateLimiter()
+
+
+class RateLimited(nextcord.ApplicationCheckFailure):
+    pass
+
+
+class ShuttingDown(nextcord.ApplicationCheckFailure):
+    pass
+
+
+@bot.application_command_check
+async def rate_limit_check(interaction: Interaction):
+    if lifecycle.stopping:
+        await interaction.response.send_message("🔄 봇이 곧 재시작됩니다. 잠시 후에 다시 시도해주세요.", ephemeral=True)
+        raise ShuttingDown("shutting down")
+    # 명령어 본문(DB 포함)에 들어가기 전에 메모리에서만 확인
+    retry_after = rate_limiter.hit(interaction.user.id)
+    if retry_after:
+        await interaction.response.send_message(
+            f"⏳ 명령어를 너무 빠르게 보내고 있어요. {retry_after:.1f}초 후에 다시 시도해주세요.", ephemeral=True)
+        raise RateLimited(f"{interaction.user.id} rate limited")
+    return True
+
+
+@bot.application_command_before_invoke
+async def before_command(interaction: Interaction):
+    lifecycle.enter()
+    interaction.attached.timing = CommandTiming()
+    command_timing.set(interaction.attached.timing)
+    if interaction.application_command.qualified_name not in LOCK_EXEMPT_COMMANDS:
+        lock = user_locks.get(interaction.user.id)
+        await lock.acquire()
+        interaction.attached.user_lock = lock
+
+
+@bot.application_command_after_invoke
+async def after_command(interaction: Interaction):
+    lock = interaction.attached.pop("user_lock", None)
+    if lock is not None:
+        lock.release()
+    metrics.record(interaction.application_command.qualified_name, interaction.attached.timing)
+    command_timing.set(None)
+    lifecycle.leave()
+
+
+@bot.listen("on_application_command_error")
+async def count_command_error(interaction: Interaction, error):
+    if interaction.application_command is not None and not isinstance(error, (RateLimited, ShuttingDown)):
+        metrics.errors[interaction.application_command.qualified_name] += 1
+
+
+@bot.event
+async def on_application_command_error(interaction: Interaction, error):
+    if isinstance(error, (RateLimited, ShuttingDown)):
+        return  # 이미 안내 메시지를 보냄
+    await nextcord.Client.on_application_command_error(bot, interaction, error)
+
+
+async def loop_lag_monitor():
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        lag = max(loop.time() - start - LOOP_LAG_INTERVAL, 0.0)
+        metrics.loop_lag.observe(lag)
+        metrics.loop_lag_max = max(metrics.loop_lag_max, lag)
+
+
+async def metrics_file_loop():
+    while True:
+        await asyncio.sleep(METRICS_INTERVAL)
+        try:
+            await asyncio.to_thread(metrics.write_file)
+        except Exception as e:
+            print(f"통계 파일 저장 실패: {e}")
+
+
+# --- 비동기 DB 계층 ---
+# 모든 쿼리는 전용 스레드 하나에서 오래 유지되는 연결 하나로 실행되므로
+# 디스크가 느려도 이벤트 루프(하트비트, 다른 서버의 명령어)는 멈추지 않습니다.
+class Database:
+    def __init__(self, path):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db")
+        self._conn = None
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        for pragma in DB_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _run(self, fn, *args):
+        # DB 스레드 안에서만 호출됨
+        if self._conn is None:
+            self._conn = self._connect()
+        return fn(self._conn, *args)
+
+    async def call(self, fn, *args):
+        """fn(conn, *args)를 DB 스레드에서 실행하고 결과를 기다립니다."""
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        try:
+            return await loop.run_in_executor(self._executor, self._run, fn, *args)
+        finally:
+            timing = command_timing.get()
+            if timing is not None:
+                timing.db += time.perf_counter() - start
+
+    async def execute(self, sql, params=()):
+        def op(conn):
+            with conn:
+                return conn.execute(sql, params).rowcount
+        return await self.call(op)
+
+    async def fetchone(self, sql, params=()):
+        return await self.call(lambda conn: conn.execute(sql, params).fetchone())
+
+    async def fetchall(self, sql, params=()):
+        return await self.call(lambda conn: conn.execute(sql, params).fetchall())
+
+    def call_sync(self, fn, *args):
+        """이벤트 루프가 없을 때(시작/종료 시) DB 스레드에서 fn을 실행하고 기다립니다."""
+        return self._executor.submit(self._run, fn, *args).result()
+
+    def close(self):
+        def op(conn):
+            conn.close()
+        if self._conn is not None:
+            self.call_sync(op)
+            self._conn = None
+        self._executor.shutdown(wait=True)
+
+    # --- 유저 관련 쿼리 ---
+    # 유저는 (guild_id, user_id)로 구분하며, 서버마다 따로 가입하고 따로 잔액을 가집니다.
+    async def get_user(self, guild_id, user_id):
+        """유저 행 전체를 반환합니다. 가입하지 않았으면 None"""
+        return await self.fetchone("SELECT * FROM users WHERE guild_id = ? AND user_id = ?", (guild_id, user_id))
+
+    async def add_user(self, guild_id, user_id, name):
+        await self.execute("INSERT OR IGNORE INTO users (guild_id, user_id, name) VALUES (?, ?, ?)",
+                           (guild_id, user_id, name))
+
+    async def delete_user(self, guild_id, user_id):
+        """유저와 게시물, 팔로우 관계를 지우고 상대방의 팔로우 수를 줄입니다.
+        (내가 팔로우하던 user_id 목록, 나를 팔로우하던 user_id 목록) 을 반환합니다."""
+        # 거래 내역은 감사 기록이므로 지우지 않고, 남은 잔액을 0으로 만드는 내역을 덧붙임
+        # (다시 가입하면 잔액 0에서 시작하므로 원장 합계와 계속 맞음)
+        now = int(time.time())
+        def op(conn):
+            with conn:
+                conn.execute(
+                    "INSERT INTO ledger (guild_id, user_id, amount, reason, actor_id, created_at) "
+                    "SELECT guild_id, user_id, -balance, '탈퇴', NULL, ? FROM users "
+                    "WHERE guild_id = ? AND user_id = ? AND balance != 0", (now, guild_id, user_id))
+                followees = [r[0] for r in conn.execute(
+                    "SELECT followee_id FROM follows WHERE guild_id = ? AND follower_id = ?", (guild_id, user_id))]
+                followers = [r[0] for r in conn.execute(
+                    "SELECT follower_id FROM follows WHERE guild_id = ? AND followee_id = ?", (guild_id, user_id))]
+                for column, counter, others in (("follower", "followers", followees), ("following", "following", followers)):
+                    conn.executemany(f"UPDATE users SET {column} = {column} - 1 WHERE guild_id = ? AND user_id = ?",
+                                     [(guild_id, other) for other in others])
+                    conn.executemany(f"UPDATE follow_counts SET {counter} = {counter} - 1 WHERE guild_id = ? AND user_id = ?",
+                                     [(guild_id, other) for other in others])
+                conn.execute("DELETE FROM follows WHERE guild_id = ? AND (follower_id = ? OR followee_id = ?)",
+                             (guild_id, user_id, user_id))
+                for table in ("users", "posts", "follow_counts"):
+                    conn.execute(f"DELETE FROM {table} WHERE guild_id = ? AND user_id = ?", (guild_id, user_id))
+                return followees, followers
+        return await self.call(op)
+
+    async def legacy_user_count(self):
+        """아직 서버가 정해지지 않은(guild_id = '') 유저 수"""
+        return (await self.fetchone("SELECT COUNT(*) FROM users WHERE guild_id = ''"))[0]
+
+    async def adopt_legacy(self, guild_id):
+        """서버 구분 없이 쌓였던 데이터(guild_id = '')를 guild_id 서버 것으로 옮깁니다."""
+        def op(conn):
+            with conn:
+                moved = conn.execute("UPDATE OR IGNORE users SET guild_id = ? WHERE guild_id = ''", (guild_id,)).rowcount
+                for table in ("cooldowns", "ledger", "balance_snapshots"):
+                    conn.execute(f"UPDATE OR IGNORE {table} SET guild_id = ? WHERE guild_id = ''", (guild_id,))
+                return moved
+        return await self.call(op)
+
+    @staticmethod
+    def _write_users(conn, rows, ledger=(), journal_seq=None):
+        columns = ", ".join(
+            f"{col} = {col} + :{col}" if col in COUNTER_COLUMNS else f"{col} = COALESCE(:{col}, {col})"
+            for col in USER_COLUMNS
+        )
+        with conn:
+            conn.executemany(f"UPDATE users SET {columns} WHERE guild_id = :guild_id AND user_id = :user_id", rows)
+            # 그 사이 탈퇴한 유저의 내역은 남기지 않음
+            conn.executemany(
+                "INSERT INTO ledger (guild_id, user_id, amount, reason, actor_id, created_at) "
+                "SELECT ?, ?, ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM users WHERE guild_id = ? AND user_id = ?)",
+                [(*entry, entry[0], entry[1]) for entry in ledger])
+            if journal_seq is not None:
+                conn.execute(
+                    "INSERT INTO meta (key, value) VALUES ('journal_seq', ?) "
+                    "ON CONFLICT(key) DO UPDATE SET value = MAX(value, excluded.value)", (journal_seq,))
+
+    async def write_users(self, rows, ledger=(), journal_seq=None):
+        """캐시에 쌓인 변경 여러 건과 그에 해당하는 거래 내역을 트랜잭션 하나로 저장합니다.
+        카운터는 증감량을 더하고(col = col + ?), 나머지는 값이 있을 때만 덮어씁니다.
+        journal_seq를 주면 저장이 끝난 저널 번호도 같은 트랜잭션으로 기록합니다."""
+        await self.call(self._write_users, rows, ledger, journal_seq)
+
+    @staticmethod
+    def _journal_seq(conn):
+        row = conn.execute("SELECT value FROM meta WHERE key = 'journal_seq'").fetchone()
+        return row[0] if row is not None else 0
+
+    async def checkpoint(self):
+        """WAL 파일의 내용을 DB 파일에 모두 옮기고 WAL을 비웁니다. (busy, WAL 페이지 수, 옮긴 페이지 수)"""
+        return tuple(await self.fetchone("PRAGMA wal_checkpoint(TRUNCATE)"))
+
+    async def import_users(self, path, guild_id):
+        """엑셀 파일의 users 시트를 guild_id 서버의 유저로 넣습니다 (user_id가 같으면 덮어씀).
+        파일은 작업 스레드에서 read_only 모드로 읽고, DB 스레드에는 EXCEL_BATCH_SIZE 행씩 임시 테이블에 넣는 일만 보냅니다.
+        다 읽은 뒤 임시 테이블에서 트랜잭션 하나로 옮기므로 중간에 오류가 나면 아무것도 바뀌지 않습니다."""
+        wb = await asyncio.to_thread(openpyxl.load_workbook, path, read_only=True)
+        stage = f"import_stage_{id(wb)}"
+        try:
+            ws = wb["users"] if "users" in wb.sheetnames else wb.active
+            rows = enumerate(ws.iter_rows(values_only=True), start=1)  # (엑셀 줄 번호, 값)
+            first = await asyncio.to_thread(next, rows, (1, ()))
+            header = [str(h).strip() if h is not None else "" for h in first[1]]
+            if "user_id" not in header:
+                raise ValueError("첫 줄에 user_id 컬럼이 있어야 합니다.")
+            columns = [col for col in header if col in USER_COLUMNS]
+            indexes = [header.index(col) for col in ["user_id", *columns]]
+
+            def parse(line, row):
+                values = [row[i] if i < len(row) else None for i in indexes]
+                if values[0] is None:
+                    return None  # 빈 줄
+                values[0] = str(values[0])
+                for pos, col in enumerate(columns, start=1):
+                    if col not in COUNTER_COLUMNS:
+                        continue
+                    if values[pos] is None or values[pos] == "":
+                        values[pos] = 0  # 빈 칸은 0
+                        continue
+                    try:
+                        values[pos] = int(values[pos])
+                    except (TypeError, ValueError):
+                        raise ValueError(f"{line}번째 줄 {col} 값이 숫자가 아닙니다: {values[pos]!r}") from None
+                return values
+
+            def read_batch():
+                batch = []
+                for line, row in rows:
+                    values = parse(line, row)
+                    if values is not None:
+                        batch.append(values)
+                        if len(batch) >= EXCEL_BATCH_SIZE:
+                            break
+                return batch
+
+            column_list = "".join(f", {col}" for col in columns)
+            await self.call(lambda conn: conn.execute(
+                f"CREATE TEMP TABLE {stage} (user_id TEXT PRIMARY KEY{column_list})"))
+
+            def stage_batch(conn, batch):
+                with conn:
+                    conn.executemany(f"INSERT OR REPLACE INTO {stage} VALUES ({', '.join('?' * (len(columns) + 1))})",
+                                     batch)
+
+            count = 0
+            while batch := await asyncio.to_thread(read_batch):
+                await self.call(stage_batch, batch)
+                count += len(batch)
+
+            def finish(conn):
+                updates = ", ".join(f"{col} = excluded.{col}" for col in columns)
+                with conn:
+                    if "balance" in columns:
+                        # 잔액을 덮어쓰기 전에 차액을 거래 내역으로 남겨 원장과 잔액이 계속 맞도록 함
+                        conn.execute(f"""
+                        INSERT INTO ledger (guild_id, user_id, amount, reason, actor_id, created_at)
+                        SELECT ?, s.user_id, s.balance - COALESCE(u.balance, 0), '엑셀 가져오기', NULL, ?
+                        FROM {stage} s LEFT JOIN users u ON u.guild_id = ? AND u.user_id = s.user_id
+                        WHERE s.balance - COALESCE(u.balance, 0) != 0
+                        """, (guild_id, int(time.time()), guild_id))
+                    conn.execute(
+                        f"INSERT INTO users (guild_id, user_id{column_list}) "
+                        f"SELECT ?, user_id{column_list} FROM {stage} WHERE true "
+                        f"ON CONFLICT(guild_id, user_id) DO " + (f"UPDATE SET {updates}" if updates else "NOTHING"),
+                        (guild_id,))
+            await self.call(finish)
+            return count
+        finally:
+            await self.call(lambda conn: conn.execute(f"DROP TABLE IF EXISTS temp.{stage}"))
+            wb.close()
+
+    async def add_balance_bulk(self, guild_id, amount, user_ids=None, reason=None, actor_id=None):
+        """guild_id 서버에서 user_ids의 잔액에 amount를 더합니다 (None이면 그 서버에 가입한 모든 유저).
+        거래 내역과 함께 트랜잭션 하나로 처리하고, 실제로 바뀐(가입한) 유저 수를 반환합니다."""
+        now = int(time.time())
+        def op(conn):
+            with conn:
+                if user_ids is None:
+                    conn.execute("INSERT INTO ledger (guild_id, user_id, amount, reason, actor_id, created_at) "
+                                 "SELECT guild_id, user_id, ?, ?, ?, ? FROM users WHERE guild_id = ?",
+                                 (amount, reason, actor_id, now, guild_id))
+                    return conn.execute("UPDATE users SET balance = balance + ? WHERE guild_id = ?",
+                                        (amount, guild_id)).rowcount
+                conn.executemany("INSERT INTO ledger (guild_id, user_id, amount, reason, actor_id, created_at) "
+                                 "SELECT guild_id, user_id, ?, ?, ?, ? FROM users WHERE guild_id = ? AND user_id = ?",
+                                 [(amount, reason, actor_id, now, guild_id, user_id) for user_id in user_ids])
+                return conn.executemany("UPDATE users SET balance = balance + ? WHERE guild_id = ? AND user_id = ?",
+                                        [(amount, guild_id, user_id) for user_id in user_ids]).rowcount
+        return await self.call(op)
+
+    # --- 잔액 원장 ---
+    async def ledger_history(self, guild_id, user_id, since, limit):
+        return await self.fetchall(
+            "SELECT amount, reason, actor_id, created_at FROM ledger "
+            "WHERE guild_id = ? AND user_id = ? AND created_at >= ? ORDER BY created_at DESC, id DESC LIMIT ?",
+            (guild_id, user_id, since, limit))
+
+    async def ledger_balance(self, guild_id, user_id):
+        """스냅샷 + 남은 거래 내역으로 다시 계산한 잔액"""
+        row = await self.fetchone(
+            "SELECT COALESCE((SELECT balance FROM balance_snapshots WHERE guild_id = ? AND user_id = ?), 0) "
+            "+ COALESCE((SELECT SUM(amount) FROM ledger WHERE guild_id = ? AND user_id = ?), 0)",
+            (guild_id, user_id, guild_id, user_id))
+        return row[0]
+
+    async def compact_ledger(self, cutoff):
+        """cutoff보다 오래된 거래 내역을 유저별 스냅샷에 더하고 지웁니다. 지운 줄 수를 반환합니다."""
+        now = int(time.time())
+        def op(conn):
+            with conn:
+                conn.execute("""
+                INSERT INTO balance_snapshots (guild_id, user_id, balance, last_ledger_id, as_of)
+                SELECT guild_id, user_id, SUM(amount), MAX(id), ? FROM ledger WHERE created_at < ?
+                GROUP BY guild_id, user_id
+                ON CONFLICT(guild_id, user_id) DO UPDATE SET
+                    balance = balance + excluded.balance,
+                    last_ledger_id = MAX(last_ledger_id, excluded.last_ledger_id),
+                    as_of = excluded.as_of
+                """, (now, cutoff))
+                return conn.execute("DELETE FROM ledger WHERE created_at < ?", (cutoff,)).rowcount
+        return await self.call(op)
+
+    # --- 팔로우/게시물 ---
+    async def set_follow(self, guild_id, follower_id, followee_id, follow):
+        """팔로우(follow=True) 또는 언팔로우하고, 실제로 바뀌었으면 True를 반환합니다.
+        팔로우 수는 관계와 같은 트랜잭션에서 1씩 더하거나 뺍니다."""
+        def op(conn):
+            with conn:
+                if follow:
+                    changed = conn.execute(
+                        "INSERT OR IGNORE INTO follows (guild_id, follower_id, followee_id, created_at) VALUES (?, ?, ?, ?)",
+                        (guild_id, follower_id, followee_id, int(time.time()))).rowcount
+                else:
+                    changed = conn.execute(
+                        "DELETE FROM follows WHERE guild_id = ? AND follower_id = ? AND followee_id = ?",
+                        (guild_id, follower_id, followee_id)).rowcount
+                if changed:
+                    step = 1 if follow else -1
+                    for user_id, counter in ((followee_id, "followers"), (follower_id, "following")):
+                        conn.execute(
+                            f"INSERT INTO follow_counts (guild_id, user_id, {counter}) VALUES (?, ?, ?) "
+                            f"ON CONFLICT(guild_id, user_id) DO UPDATE SET {counter} = {counter} + excluded.{counter}",
+                            (guild_id, user_id, step))
+                return bool(changed)
+        return await self.call(op)
+
+    async def add_post(self, guild_id, user_id, content, fanout_limit):
+        """게시물을 저장하고 (post_id, created_at, 글을 넣어 줄 팔로워 목록) 을 반환합니다.
+        팔로워가 fanout_limit명보다 많으면 팔로워 목록 대신 None (읽을 때 가져감)"""
+        now = int(time.time())
+        def op(conn):
+            with conn:
+                post_id = conn.execute(
+                    "INSERT INTO posts (guild_id, user_id, content, created_at) VALUES (?, ?, ?, ?) RETURNING id",
+                    (guild_id, user_id, content, now)).fetchone()[0]
+            row = conn.execute("SELECT followers FROM follow_counts WHERE guild_id = ? AND user_id = ?",
+                               (guild_id, user_id)).fetchone()
+            if row is not None and row[0] > fanout_limit:
+                return post_id, now, None
+            followers = [r[0] for r in conn.execute(
+                "SELECT follower_id FROM follows WHERE guild_id = ? AND followee_id = ?", (guild_id, user_id))]
+            return post_id, now, followers
+        return await self.call(op)
+
+    async def timeline_posts(self, guild_id, user_id, limit, fanout_limit, celebrities):
+        """user_id의 타임라인 글 (post_id, 작성자 id, 이름, 내용, 시각) 최신순.
+        celebrities=False면 자기 글 + 팔로워 fanout_limit명 이하인 사람의 글 (메모리 타임라인에 들어가는 글),
+        True면 팔로워가 더 많은 사람의 글 (읽을 때마다 가져오는 글)"""
+        condition = "c.followers > ?" if celebrities else "COALESCE(c.followers, 0) <= ?"
+        own = "" if celebrities else "p.user_id = ? OR "
+        params = [guild_id] + ([] if celebrities else [user_id]) + [guild_id, user_id, fanout_limit, limit]
+        return await self.fetchall(f"""
+            SELECT p.id, p.user_id, u.name, p.content, p.created_at FROM posts p
+            JOIN users u ON u.guild_id = p.guild_id AND u.user_id = p.user_id
+            WHERE p.guild_id = ? AND ({own}p.user_id IN (
+                SELECT f.followee_id FROM follows f
+                LEFT JOIN follow_counts c ON c.guild_id = f.guild_id AND c.user_id = f.followee_id
+                WHERE f.guild_id = ? AND f.follower_id = ? AND {condition}))
+            ORDER BY p.id DESC LIMIT ?
+            """, params)
+
+    async def prune_posts(self, cutoff):
+        return await self.execute("DELETE FROM posts WHERE created_at < ?", (cutoff,))
+
+    # --- 자동응답 ---
+    async def custom_replies(self, guild_id=None):
+        """(guild_id, 트리거, 답변, 가중치) 목록. guild_id가 None이면 전부"""
+        if guild_id is None:
+            return await self.fetchall("SELECT guild_id, trigger, reply, weight FROM custom_replies")
+        return await self.fetchall("SELECT guild_id, trigger, reply, weight FROM custom_replies WHERE guild_id = ?",
+                                   (guild_id,))
+
+    async def set_custom_reply(self, guild_id, trigger, reply, weight):
+        await self.execute(
+            "INSERT INTO custom_replies (guild_id, trigger, reply, weight) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(guild_id, trigger, reply) DO UPDATE SET weight = excluded.weight",
+            (guild_id, trigger, reply, weight))
+
+    async def delete_custom_reply(self, guild_id, trigger, reply=None):
+        """답변 하나(reply가 None이면 트리거 전체)를 지우고 지운 개수를 반환합니다."""
+        if reply is None:
+            return await self.execute("DELETE FROM custom_replies WHERE guild_id = ? AND trigger = ?", (guild_id, trigger))
+        return await self.execute("DELETE FROM custom_replies WHERE guild_id = ? AND trigger = ? AND reply = ?",
+                                  (guild_id, trigger, reply))
+
+    async def write_cooldowns(self, rows, now):
+        """(guild_id, user_id, command, expires_at) 를 저장하고 만료된 쿨타임은 지웁니다."""
+        def op(conn):
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO cooldowns (guild_id, user_id, command, expires_at) "
+                                 "VALUES (?, ?, ?, ?)", rows)
+                conn.execute("DELETE FROM cooldowns WHERE expires_at <= ?", (now,))
+        await self.call(op)
+
+    async def rank_page(self, guild_id, column, limit, after=None):
+        """guild_id 서버의 column 기준 랭킹을 (user_id, name, 값) 으로 반환합니다.
+        after=(값, user_id)를 주면 그 다음 순위부터 가져옵니다 (keyset 페이지네이션)."""
+        if column not in RANKING_STATS:
+            raise ValueError(f"랭킹을 지원하지 않는 컬럼입니다: {column}")
+        if after is None:
+            return await self.fetchall(
+                f"SELECT user_id, name, {column} FROM users WHERE guild_id = ? "
+                f"ORDER BY {column} DESC, user_id LIMIT ?", (guild_id, limit))
+        value, user_id = after
+        return await self.fetchall(
+            f"SELECT user_id, name, {column} FROM users "
+            f"WHERE guild_id = ? AND ({column} < ? OR ({column} = ? AND user_id > ?)) "
+            f"ORDER BY {column} DESC, user_id LIMIT ?",
+            (guild_id, value, value, user_id, limit))
+
+
+
+
+# --- 엑셀 내보내기 ---
+def export_users_xlsx(path, db_path, guild_id):
+    """guild_id 서버의 유저와 잔액 원장을 write-only 모드로 한 줄씩 엑셀 파일에 씁니다.
+    DB 스레드를 막지 않도록 별도의 읽기 전용 연결을 쓰며, WAL 덕분에 쓰기와 동시에 진행됩니다."""
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    wb = openpyxl.Workbook(write_only=True)
     try:
-        last_time = datetime.strptime(last_time_str, "%Y-%m-%d %H:%M:%S")
-        now = datetime.now()
-        remaining = (last_time + timedelta(minutes=cooldown_minutes)) - now
-        if remaining.total_seconds() > 0:
-            return True, int(remaining.total_seconds())
+        count = 0
+        for sheet, columns, sql in (
+            ("users", ["user_id", *USER_COLUMNS],
+             f"SELECT user_id, {', '.join(USER_COLUMNS)} FROM users WHERE guild_id = ? ORDER BY user_id"),
+            ("ledger", ["id", "user_id", "amount", "reason", "actor_id", "created_at"],
+             "SELECT id, user_id, amount, reason, actor_id, created_at FROM ledger WHERE guild_id = ? ORDER BY id"),
+            ("balance_snapshots", ["user_id", "balance", "last_ledger_id", "as_of"],
+             "SELECT user_id, balance, last_ledger_id, as_of FROM balance_snapshots WHERE guild_id = ? ORDER BY user_id"),
+        ):
+            ws = wb.create_sheet(sheet)
+            ws.append(columns)
+            cursor = conn.execute(sql, (guild_id,))
+            while True:
+                rows = cursor.fetchmany(EXCEL_BATCH_SIZE)
+                if not rows:
+                    break
+                for row in rows:
+                    ws.append(row)
+                if sheet == "users":
+                    count += len(rows)
+        wb.save(path)
+        return count
+    finally:
+        conn.close()
+
+
+# --- 변경 저널 (write-ahead) ---
+# UserCache는 변경을 CACHE_FLUSH_INTERVAL_MS 동안 메모리에 모았다가 한 번에 쓰므로 그 사이 프로세스가 죽으면 보상이 사라집니다.
+# 그래서 변경할 때마다 번호를 붙여 저널 파일에 한 줄씩 먼저 남기고, 저장 트랜잭션에서 마지막 번호를 meta 테이블에 함께 기록합니다.
+# 다음에 시작할 때 그보다 큰 번호의 변경만 다시 적용합니다. 파일은 저장할 때마다 새 조각으로 바꾸고, 저장이 끝난 조각은 지웁니다.
+class IntentJournal:
+    def __init__(self, path):
+        self.path = path  # 조각 파일은 path.1, path.2, ...
+        self.seq = 0
+        self._file = None
+        self._segment = 0
+
+    def segments(self):
+        directory, prefix = os.path.split(self.path)
+        found = []
+        for name in os.listdir(directory or "."):
+            suffix = name[len(prefix) + 1:]
+            if name.startswith(prefix + ".") and suffix.isdigit():
+                found.append((int(suffix), os.path.join(directory, name)))
+        return [path for _, path in sorted(found)]
+
+    def read(self):
+        """남아 있는 조각의 기록을 번호순으로 읽습니다. 쓰다가 끊긴 마지막 줄은 버립니다."""
+        records = []
+        for path in self.segments():
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        break
+        return records
+
+    def open(self, seq):
+        """seq 다음 번호부터 새 조각에 쓰고, 그전부터 남아 있던 조각 목록을 반환합니다."""
+        old = self.segments()
+        self.seq = seq
+        self._segment = int(old[-1].rsplit(".", 1)[1]) if old else 0
+        self._next_segment()
+        return old
+
+    def _next_segment(self):
+        self._segment += 1
+        self._file = open(f"{self.path}.{self._segment}", "a", encoding="utf-8")
+
+    def append(self, record):
+        self.seq += 1
+        self._file.write(json.dumps({"seq": self.seq, **record}, ensure_ascii=False) + "\n")
+        self._file.flush()  # 프로세스가 죽어도 OS에는 남도록
+
+    def rotate(self):
+        """지금 조각을 닫고 새 조각으로 바꾼 뒤 (마지막 번호, 닫은 조각 목록) 을 반환합니다."""
+        self._file.close()
+        closed = [self._file.name]
+        self._next_segment()
+        return self.seq, closed
+
+    @staticmethod
+    def discard(segments):
+        """조각을 지웁니다. 그 안의 변경이 DB에 저장됐거나 다시 기록된 뒤에만 부릅니다."""
+        for path in segments:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+# --- 유저 캐시 (write-back) ---
+# 자주 쓰는 유저 행을 메모리에 두고, 변경분만 주기적으로 한 번에 DB에 씁니다.
+# 키는 (guild_id, user_id) 입니다.
+class UserCache:
+    def __init__(self, db, journal=None, max_size=USER_CACHE_SIZE):
+        self.db = db
+        self.journal = journal
+        self.max_size = max_size
+        self._rows = OrderedDict()  # key -> 행(dict), 오래 안 쓴 순서
+        self._pending = {}  # key -> 아직 저장 안 된 변경 (카운터는 증감량)
+        self._evicted = {}  # 밀려났지만 아직 저장 안 된 행
+        self._listeners = []  # 행이 바뀔 때 호출할 함수 (key, row)
+        self._ledger = []  # 아직 저장 안 된 잔액 거래 내역 (guild_id, user_id, amount, reason, actor_id, created_at)
+
+    async def get(self, key):
+        """유저 행(dict)을 반환합니다. 가입하지 않았으면 None"""
+        row = self._rows.get(key)
+        if row is not None:
+            self._rows.move_to_end(key)
+            return row
+        row = self._evicted.pop(key, None)
+        if row is None:
+            fetched = await self.db.get_user(*key)
+            if fetched is None:
+                return None
+            # 기다리는 동안 다른 명령어가 같은 행을 먼저 올렸을 수 있음
+            row = self._rows.get(key) or dict(fetched)
+        self._rows[key] = row
+        self._rows.move_to_end(key)
+        self._evict()
+        return row
+
+    def apply(self, key, deltas=None, when=None, reason=None, actor_id=None, **fields):
+        """카운터 컬럼은 deltas만큼 더하고, 나머지 컬럼은 fields 값으로 바꾼 뒤 새 행을 반환합니다.
+        when(row)가 거짓이면 아무것도 바꾸지 않고 None을 반환합니다.
+        확인과 변경 사이에 await가 없어서 같은 유저가 명령어를 동시에 보내도 변경이 사라지지 않습니다.
+        잔액이 바뀌면 reason/actor_id와 함께 거래 내역을 남기고, 잔액 변경과 같은 트랜잭션으로 저장합니다."""
+        row = self._rows.get(key) or self._evicted.get(key)
+        if row is None or (when is not None and not when(row)):
+            return None
+        entry = None
+        if deltas and deltas.get("balance"):
+            entry = (*key, deltas["balance"], reason, actor_id, int(time.time()))
+            self._ledger.append(entry)
+        self._journal(key, deltas, fields, entry)
+        self._stage(key, deltas, fields)
+        for col, delta in (deltas or {}).items():
+            row[col] = (row[col] or 0) + delta
+        row.update(fields)
+        for listener in self._listeners:
+            listener(key, row)
+        return row
+
+    def _journal(self, key, deltas, fields, ledger=None):
+        if self.journal is not None:
+            self.journal.append({"key": key, "deltas": deltas or {}, "fields": fields, "ledger": ledger})
+
+    def _stage(self, key, deltas, fields):
+        pending = self._pending.setdefault(key, {})
+        for col, delta in (deltas or {}).items():
+            pending[col] = pending.get(col, 0) + delta
+        pending.update(fields)
+
+    def recover(self):
+        """시작할 때 저널에만 남고 DB에 저장되지 못한 변경을 저장합니다. 복구한 변경 수를 반환합니다."""
+        done = self.db.call_sync(Database._journal_seq)
+        records = [record for record in self.journal.read() if record["seq"] > done]
+        for record in records:
+            self._stage(tuple(record["key"]), record["deltas"], record["fields"])
+            if record["ledger"]:
+                self._ledger.append(tuple(record["ledger"]))
+        seq = max([done] + [record["seq"] for record in records])
+        old = self.journal.open(seq)
+        if records:
+            _, rows, ledger = self._take()
+            self.db.call_sync(Database._write_users, rows, ledger, seq)
+        self.journal.discard(old)
+        return len(records)
+
+    def subscribe(self, listener):
+        self._listeners.append(listener)
+
+    def dirty_rows(self):
+        """아직 DB에 저장되지 않은 변경이 있는 행들"""
+        for key in self._pending:
+            row = self._rows.get(key) or self._evicted.get(key)
+            if row is not None:
+                yield key, row
+
+    def discard(self, key):
+        self._rows.pop(key, None)
+        self._evicted.pop(key, None)
+        self._pending.pop(key, None)
+        self._ledger = [entry for entry in self._ledger if entry[:2] != key]
+
+    def shift(self, column, delta, guild_id, user_ids=None):
+        """DB에 이미 반영된 증감을 메모리의 행에도 똑같이 반영합니다 (user_ids가 None이면 그 서버 전부).
+        저장할 변경으로 기록하지 않으므로 DB에 두 번 더해지지 않습니다."""
+        if user_ids is None:
+            targets = [key for key in self._rows.keys() | self._evicted.keys() if key[0] == guild_id]
         else:
-            return False, 0
-    except Exception:
-        return False, 0
-    
+            targets = [(guild_id, user_id) for user_id in user_ids]
+        for key in targets:
+            row = self._rows.get(key) or self._evicted.get(key)
+            if row is not None:
+                row[column] = (row[column] or 0) + delta
+                for listener in self._listeners:
+                    listener(key, row)
+
+    def invalidate(self):
+        """DB가 밖에서 바뀌었을 때 저장할 변경이 없는 행을 버려 다음 조회 때 다시 읽게 합니다."""
+        for key in [key for key in self._rows if key not in self._pending]:
+            del self._rows[key]
+
+    def _evict(self):
+        while len(self._rows) > self.max_size:
+            key, row = self._rows.popitem(last=False)
+            if key in self._pending:
+                self._evicted[key] = row
+
+    def _take(self):
+        """쌓인 변경을 꺼내 (pending, write_users에 넘길 행, 거래 내역) 으로 반환합니다."""
+        pending, self._pending = self._pending, {}
+        ledger, self._ledger = self._ledger, []
+        rows = []
+        for (guild_id, user_id), changes in pending.items():
+            row = {col: 0 if col in COUNTER_COLUMNS else None for col in USER_COLUMNS}
+            row.update(changes, guild_id=guild_id, user_id=user_id)
+            rows.append(row)
+        return pending, rows, ledger
+
+    async def flush(self):
+        """쌓인 변경을 트랜잭션 하나로 저장합니다."""
+        if not self._pending:
+            return 0
+        # 꺼내는 것과 저널 조각을 바꾸는 것 사이에 await가 없어서 닫은 조각의 변경은 모두 이번 저장에 들어감
+        seq, segments = self.journal.rotate() if self.journal is not None else (None, [])
+        pending, rows, ledger = self._take()
+        # 부른 쪽이 취소돼도(종료 등) 저장과 그 뒤처리는 끝까지 하도록 따로 돌리고 결과만 기다림
+        write = asyncio.ensure_future(self.db.write_users(rows, ledger, seq))
+        write.add_done_callback(functools.partial(self._written, pending, ledger, segments))
+        await asyncio.shield(write)
+        return len(rows)
+
+    def _written(self, pending, ledger, segments, write):
+        if write.cancelled():
+            # 이벤트 루프를 정리하면서 취소됨. DB 스레드에서 이미 커밋했을 수도 있으므로 되돌려 놓지 않고
+            # 저널 조각을 남겨 둬서 다음 시작 때 recover()가 meta.journal_seq를 보고 정하게 함
+            return
+        if write.exception() is not None:
+            # 다음 주기에 다시 시도. 그 사이 다른 저장이 더 큰 번호를 기록할 수 있으므로 새 번호로 다시 저널에 남김
+            for key, changes in self._restore(pending).items():
+                deltas = {col: value for col, value in changes.items() if col in COUNTER_COLUMNS}
+                self._journal(key, deltas, {col: value for col, value in changes.items() if col not in deltas})
+            for entry in ledger:
+                self._journal(entry[:2], {}, {}, entry)
+            self._ledger = ledger + self._ledger
+            IntentJournal.discard(segments)
+            return
+        IntentJournal.discard(segments)
+        for key in pending:
+            if key not in self._pending:
+                self._evicted.pop(key, None)
+
+    def _restore(self, pending):
+        """저장하지 못한 변경을 되돌려 놓고, 실제로 되돌린 변경을 반환합니다."""
+        restored = {}
+        for key, changes in pending.items():
+            current = self._pending.setdefault(key, {})
+            restored[key] = {}
+            for col, value in changes.items():
+                if col in COUNTER_COLUMNS:
+                    current[col] = current.get(col, 0) + value
+                elif col in current:
+                    continue  # 그 사이 바뀐 값이 더 최신
+                else:
+                    current[col] = value
+                restored[key][col] = value
+        return restored
+
+
+# --- 랭킹 (메모리 top-K) ---
+# 스탯이 바뀔 때마다 상위 LEADERBOARD_SIZE명을 갱신해 두고, 그 밖의 순위만 인덱스로 조회합니다.
+class Leaderboard:
+    def __init__(self, column, size=LEADERBOARD_SIZE):
+        self.column = column
+        self.size = size
+        self._entries = {}  # user_id -> (값, 이름)
+        self._ranked = None  # 정렬 결과 캐시
+        self.loaded = False
+        self.complete = False  # 전체 유저가 size명 이하라 모두 들어있음
+
+    @staticmethod
+    def _key(user_id, value):
+        return (-value, user_id)  # ORDER BY value DESC, user_id 와 같은 순서
+
+    def load(self, rows):
+        self._entries = {row[0]: (row[2] or 0, row[1]) for row in rows}
+        self._ranked = None
+        self.loaded = True
+        self.complete = len(rows) < self.size
+
+    def ranked(self):
+        """[(user_id, 이름, 값), ...] 순위순"""
+        if self._ranked is None:
+            self._ranked = sorted(
+                ((uid, name, value) for uid, (value, name) in self._entries.items()),
+                key=lambda e: self._key(e[0], e[2]))
+        return self._ranked
+
+    def _lowest(self):
+        return max(self._entries.items(), key=lambda item: self._key(item[0], item[1][0]))
+
+    def update(self, user_id, value, name):
+        if not self.loaded:
+            return
+        self._ranked = None
+        if user_id in self._entries:
+            old = self._entries[user_id][0]
+            self._entries[user_id] = (value, name)
+            # 꼴찌로 내려갔다면 밖에 있던 유저가 더 높을 수 있으니 다음 조회 때 다시 채움
+            if value < old and not self.complete and self._lowest()[0] == user_id:
+                self.loaded = False
+        elif len(self._entries) < self.size:
+            if self.complete:
+                self._entries[user_id] = (value, name)
+                # 가득 차면 다음 유저부터는 밖에 남을 수 있으므로 더는 전체가 아님
+                self.complete = len(self._entries) < self.size
+        else:
+            self.complete = False  # 이 유저가 들어오든 못 들어오든 밖에 누군가 있음
+            lowest_id, (lowest_value, _) = self._lowest()
+            if self._key(user_id, value) < self._key(lowest_id, lowest_value):
+                del self._entries[lowest_id]
+                self._entries[user_id] = (value, name)
+
+    def remove(self, user_id):
+        if self._entries.pop(user_id, None) is not None:
+            self._ranked = None
+            if not self.complete:
+                self.loaded = False
+
+
+class Leaderboards:
+    """서버마다 스탯별 Leaderboard를 따로 둡니다. 한 번도 조회하지 않은 서버는 만들지 않습니다."""
+
+    def __init__(self, db, cache):
+        self.db = db
+        self.cache = cache
+        self.guilds = {}  # guild_id -> {col: Leaderboard}
+        cache.subscribe(self.on_change)
+
+    def on_change(self, key, row):
+        guild_id, user_id = key
+        for col, board in self.guilds.get(guild_id, {}).items():
+            board.update(user_id, row[col] or 0, row["name"])
+
+    def remove(self, key):
+        guild_id, user_id = key
+        for board in self.guilds.get(guild_id, {}).values():
+            board.remove(user_id)
+
+    def invalidate(self, guild_id=None):
+        guilds = self.guilds.values() if guild_id is None else [self.guilds.get(guild_id, {})]
+        for boards in guilds:
+            for board in boards.values():
+                board.loaded = False
+
+    async def _ensure_loaded(self, guild_id, board):
+        if board.loaded:
+            return
+        await self.cache.flush()  # 아직 저장 안 된 변경까지 반영
+        board.load(await self.db.rank_page(guild_id, board.column, board.size))
+        # 조회하는 동안 바뀐 행 반영
+        for (row_guild_id, user_id), row in self.cache.dirty_rows():
+            if row_guild_id == guild_id:
+                board.update(user_id, row[board.column] or 0, row["name"])
+
+    async def page(self, guild_id, column, limit, after=None):
+        """[(user_id, 이름, 값), ...] 를 after 다음 순위부터 limit개 반환합니다."""
+        boards = self.guilds.setdefault(guild_id, {})
+        board = boards.get(column)
+        if board is None:
+            board = boards[column] = Leaderboard(column)
+        await self._ensure_loaded(guild_id, board)
+        ranked = board.ranked()
+        start = 0
+        if after is not None:
+            keys = [board._key(uid, value) for uid, _, value in ranked]
+            start = bisect.bisect_right(keys, board._key(after[1], after[0]))
+        if start + limit <= len(ranked) or board.complete:
+            return ranked[start:start + limit]
+        # top-K 밖의 순위는 인덱스를 타는 keyset 쿼리로
+        await self.cache.flush()
+        return [tuple(row) for row in await self.db.rank_page(guild_id, column, limit, after)]
+
+
+# --- 타임라인 (팔로우한 사람의 게시물) ---
+# 글을 올릴 때 팔로워들의 타임라인에 미리 넣어 두고(fan-out-on-write), 읽을 때는 메모리에서 바로 꺼냅니다.
+# 팔로워가 FANOUT_LIMIT명보다 많은 유저의 글은 넣어 주지 않고 읽을 때마다 가져와 합칩니다(fan-out-on-read).
+# 메모리에는 최근에 본 TIMELINE_CACHE_USERS명의 타임라인만 TIMELINE_SIZE개씩 두고, 없으면 DB에서 다시 만듭니다.
+class Timelines:
+    def __init__(self, db, size=TIMELINE_SIZE, max_users=TIMELINE_CACHE_USERS, fanout_limit=FANOUT_LIMIT):
+        self.db = db
+        self.size = size
+        self.max_users = max_users
+        self.fanout_limit = fanout_limit
+        self._timelines = OrderedDict()  # (guild_id, user_id) -> deque[(post_id, 작성자 id, 이름, 내용, 시각)] 오래된 순
+
+    def _push(self, key, post):
+        timeline = self._timelines.get(key)
+        if timeline is not None:
+            timeline.append(post)
+
+    async def publish(self, key, name, content):
+        """게시물을 저장하고 작성자와 팔로워들의 메모리 타임라인에 넣습니다."""
+        guild_id, user_id = key
+        post_id, created_at, followers = await self.db.add_post(guild_id, user_id, content, self.fanout_limit)
+        post = (post_id, user_id, name, content, created_at)
+        self._push(key, post)
+        for follower_id in followers or ():
+            self._push((guild_id, follower_id), post)
+
+    async def _build(self, key):
+        # 만드는 동안 올라온 글도 받도록 빈 타임라인을 먼저 등록해 둠
+        timeline = self._timelines[key] = deque(maxlen=self.size)
+        self._evict()
+        try:
+            rows = await self.db.timeline_posts(*key, self.size, self.fanout_limit, celebrities=False)
+        except Exception:
+            self._timelines.pop(key, None)
+            raise
+        posts = {post[0]: post for post in [tuple(row) for row in rows] + list(timeline)}
+        timeline.clear()
+        timeline.extend(sorted(posts.values())[-self.size:])
+        return timeline
+
+    async def get(self, key, limit):
+        """key의 타임라인에서 최신 글 limit개를 최신순으로 반환합니다."""
+        timeline = self._timelines.get(key)
+        if timeline is None:
+            timeline = await self._build(key)
+        else:
+            self._timelines.move_to_end(key)
+        cached = list(timeline)
+        pulled = await self.db.timeline_posts(*key, limit, self.fanout_limit, celebrities=True)
+        merged = heapq.merge(reversed(cached), (tuple(row) for row in pulled), reverse=True)
+        posts, seen = [], set()
+        for post in merged:
+            if post[0] not in seen:
+                seen.add(post[0])
+                posts.append(post)
+                if len(posts) == limit:
+                    break
+        return posts
+
+    def invalidate(self, key=None, guild_id=None):
+        """key의 타임라인(또는 guild_id 서버 전체, 둘 다 없으면 전부)을 버려 다음 조회 때 DB에서 다시 만듭니다."""
+        if key is not None:
+            self._timelines.pop(key, None)
+        elif guild_id is not None:
+            for cached in [k for k in self._timelines if k[0] == guild_id]:
+                del self._timelines[cached]
+        else:
+            self._timelines.clear()
+
+    def _evict(self):
+        while len(self._timelines) > self.max_users:
+            self._timelines.popitem(last=False)
+
+
+# --- 쿨타임 ---
+# 만료 시각을 메모리(dict + 힙)에서 바로 확인하므로 쿨타임에 걸린 호출은 DB에 닿지 않습니다.
+# 새로 건 쿨타임만 주기적으로 cooldowns 테이블에 저장해 재시작 후에도 유지합니다.
+class CooldownManager:
+    def __init__(self, db, config=COOLDOWNS):
+        self.db = db
+        self.config = config
+        self._expires = {}  # (command, (guild_id, user_id)) -> 만료 epoch 초
+        self._heap = []  # (만료 시각, key) - 만료된 항목 정리용
+        self._pending = {}  # 아직 저장 안 된 쿨타임
+
+    def remaining(self, command, key, now=None):
+        now = int(time.time()) if now is None else now
+        return max(self._expires.get((command, key), 0) - now, 0)
+
+    def hit(self, command, key):
+        """쿨타임 중이면 남은 초를, 아니면 쿨타임을 걸고 0을 반환합니다."""
+        now = int(time.time())
+        self._prune(now)
+        left = self.remaining(command, key, now)
+        if left:
+            return left
+        self._set((command, key), now + self.config[command])
+        return 0
+
+    def reset(self, command, key):
+        self._set((command, key), 0)
+
+    def _set(self, key, expires_at):
+        self._pending[key] = expires_at
+        if expires_at:
+            self._expires[key] = expires_at
+            heapq.heappush(self._heap, (expires_at, key))
+        else:
+            self._expires.pop(key, None)
+
+    def _prune(self, now):
+        while self._heap and self._heap[0][0] <= now:
+            expires_at, key = heapq.heappop(self._heap)
+            if self._expires.get(key) == expires_at:
+                del self._expires[key]
+
+    _LOAD_SQL = "SELECT guild_id, user_id, command, expires_at FROM cooldowns WHERE expires_at > ?"
+
+    def load(self):
+        """시작할 때 아직 끝나지 않은 쿨타임을 불러옵니다."""
+        now = int(time.time())
+        self._load_rows(self.db.call_sync(lambda conn: conn.execute(self._LOAD_SQL, (now,)).fetchall()))
+
+    async def reload(self):
+        """봇이 돌고 있는 중에 DB의 쿨타임을 다시 읽습니다. (이벤트 루프를 막지 않음)"""
+        self._load_rows(await self.db.fetchall(self._LOAD_SQL, (int(time.time()),)))
+
+    def _load_rows(self, rows):
+        for guild_id, user_id, command, expires_at in rows:
+            key = (command, (guild_id, user_id))
+            # 읽는 사이에 새로 걸린 쿨타임이 더 길면 그대로 둠
+            if expires_at > self._expires.get(key, 0):
+                self._expires[key] = expires_at
+                heapq.heappush(self._heap, (expires_at, key))
+
+    async def flush(self):
+        if not self._pending:
+            return 0
+        pending, self._pending = self._pending, {}
+        rows = [(guild_id, user_id, command, expires_at)
+                for (command, (guild_id, user_id)), expires_at in pending.items()]
+        # UserCache.flush와 같이 부른 쪽이 취소돼도 실패하면 되돌려 놓음
+        write = asyncio.ensure_future(self.db.write_cooldowns(rows, int(time.time())))
+        write.add_done_callback(functools.partial(self._written, pending))
+        await asyncio.shield(write)
+        return len(rows)
+
+    def _written(self, pending, write):
+        if write.cancelled() or write.exception() is not None:
+            self._pending = {**pending, **self._pending}
+
+
+# --- 서버별 저장소 나누기 ---
+# 서버 ID를 디스코드 샤드 번호와 같은 공식((guild_id >> 22) % 개수)으로 나눠 DB 파일을 고릅니다.
+# 파일마다 DB 스레드, 유저 캐시, 랭킹, 쿨타임을 따로 가지므로 한 서버의 쓰기가 다른 서버를 막지 않습니다.
+class Partition:
+    def __init__(self, path):
+        self.path = path
+        self.db = Database(path)
+        self.users = UserCache(self.db, IntentJournal(f"{path}.intent"))
+        self.leaderboards = Leaderboards(self.db, self.users)
+        self.cooldowns = CooldownManager(self.db)
+        self.timelines = Timelines(self.db)
+
+    async def reset(self):
+        """DB 파일 내용이 통째로 바뀌었을 때(복원) 메모리에 들고 있던 상태를 버립니다."""
+        self.users = UserCache(self.db, self.users.journal)
+        self.leaderboards = Leaderboards(self.db, self.users)
+        self.cooldowns = CooldownManager(self.db, self.cooldowns.config)
+        self.timelines = Timelines(self.db)
+        await self.cooldowns.reload()
+
+
+def partition_paths(count=DB_PARTITIONS):
+    # 0번은 DB_FILE 그대로 (기존 data.db), 나머지는 data.1.db, data.2.db ...
+    root, ext = os.path.splitext(DB_FILE)
+    return [DB_FILE] + [f"{root}.{i}{ext}" for i in range(1, count)]
+
+
+partitions = [Partition(path) for path in partition_paths()]
+
+
+def partition_for(guild_id):
+    return partitions[(int(guild_id) >> 22) % len(partitions)]
+
+
+def storage(interaction, user=None):
+    """명령어를 보낸 서버의 (파티션, (guild_id, user_id)). user를 주면 그 유저의 키"""
+    user = user or interaction.user
+    return partition_for(interaction.guild_id), (str(interaction.guild_id), str(user.id))
+
+
+def init_storage():
+    for partition in partitions:
+        init_db(partition.path)
+        recovered = partition.users.recover()
+        if recovered:
+            print(f"저널에서 저장되지 않은 변경 {recovered}건을 복구했습니다 ({partition.path})")
+        partition.cooldowns.load()
+    custom_replies.load()
+
+
+def close_storage():
+    for partition in partitions:
+        partition.users.journal.close()
+        partition.db.close()
+
+
+async def adopt_legacy_data():
+    """서버 구분 없이 쌓였던 데이터를 LEGACY_GUILD_ID 서버(없으면 봇이 들어가 있는 유일한 서버)로 옮깁니다."""
+    legacy = await partitions[0].db.legacy_user_count()
+    if not legacy:
+        return
+    if LEGACY_GUILD_ID:
+        guild_id = LEGACY_GUILD_ID  # 마이그레이션 뒤에 설정해도 여기서 옮김
+    elif len(bot.guilds) == 1:
+        guild_id = str(bot.guilds[0].id)
+    else:
+        print(f"경고: 서버가 정해지지 않은 기존 유저 {legacy}명의 데이터(잔액 등)가 어느 서버에서도 보이지 않습니다. "
+              f"봇이 서버 {len(bot.guilds)}개에 있어 자동으로 옮길 수 없으니, "
+              f"LEGACY_GUILD_ID 환경변수에 원래 서버 ID를 넣고 다시 시작해주세요.")
+        return
+    if partition_for(guild_id) is not partitions[0]:
+        print(f"서버 {guild_id}는 {partition_for(guild_id).path}에 저장됩니다. "
+              f"기존 데이터를 옮기려면 DB_PARTITIONS=1로 한 번 실행해 주세요.")
+        return
+    moved = await partitions[0].db.adopt_legacy(guild_id)
+    if moved:
+        await partitions[0].cooldowns.reload()  # 옮긴 쿨타임을 새 키로 다시 읽음
+        print(f"기존 유저 {moved}명을 서버 {guild_id}로 옮겼습니다.")
+
+
+def cooldown_message(secs_left):
+    mins = secs_left // 60
+    secs = secs_left % 60
+    return f"⏳ 쿨타임입니다. {mins}분 {secs}초 후에 다시 시도해주세요."
+
+
+# --- 멤버 캐시 (필요할 때만) ---
+# 명령어는 보낸 사람이나 고른 멤버만 다루므로 모든 멤버를 들고 있지 않고,
+# 그 밖에 필요한 멤버만 fetch_member로 가져와 TTL 동안 최근 MEMBER_CACHE_SIZE명까지 보관합니다.
+class MemberCache:
+    def __init__(self, max_size=MEMBER_CACHE_SIZE, ttl=MEMBER_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._members = OrderedDict()  # (guild_id, user_id) -> (member 또는 None, 만료 시각)
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._members)
+
+    async def get(self, guild, user_id):
+        """guild의 멤버를 반환합니다. 서버에 없으면 None (없다는 결과도 TTL 동안 보관)"""
+        member = guild.get_member(user_id)
+        if member is not None:
+            return member
+        key = (guild.id, user_id)
+        now = time.monotonic()
+        entry = self._members.get(key)
+        if entry is not None and entry[1] > now:
+            self._members.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+        self.misses += 1
+        try:
+            member = await guild.fetch_member(user_id)
+        except nextcord.NotFound:
+            member = None
+        self._members[key] = (member, now + self.ttl)
+        self._members.move_to_end(key)
+        while len(self._members) > self.max_size:
+            self._members.popitem(last=False)
+        return member
+
+
+member_cache = MemberCache()
+
+
+async def role_members(role):
+    """역할을 가진 멤버 목록. 멤버 목록을 캐시하지 않는 설정이면 그때 한 번 받아오고 보관하지 않습니다."""
+    if role.guild.chunked:
+        return role.members
+    members = await role.guild.chunk(cache=False)
+    return [member for member in members if member.get_role(role.id) is not None]
+
+
+def max_rss_mb():
+    """지금까지의 최대 메모리 사용량 (MB). 알 수 없으면 None"""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024  # macOS는 바이트, 리눅스는 KB
+
+
+def cached_member_count():
+    return sum(len(guild.members) for guild in bot.guilds)
+
+
+def startup_report():
+    rss = max_rss_mb()
+    steps = " · ".join(f"{name} {seconds:.2f}초" for name, seconds in startup_steps.items())
+    return (f"시작 완료: {time.monotonic() - STARTED_AT:.1f}초, 서버 {len(bot.guilds)}개, "
+            f"캐시된 멤버 {cached_member_count():,}명 (정책: {MEMBER_CACHE}), "
+            f"최대 메모리 {f'{rss:.0f}MB' if rss is not None else '알 수 없음'}\n"
+            f"단계별: {steps}")
+
+
+# --- 쌓인 변경 주기적 저장 ---
+async def flush_all():
+    for partition in partitions:
+        for name, store in (("유저 캐시", partition.users), ("쿨타임", partition.cooldowns)):
+            try:
+                await store.flush()
+            except Exception as e:
+                print(f"{name} 저장 실패 ({partition.path}): {e}")
+
+
+async def flush_loop():
+    # 종료할 때는 취소하지 않고 이 표시로 멈춤 (저장 도중에 끊기지 않도록)
+    while not lifecycle.stopping:
+        await asyncio.sleep(CACHE_FLUSH_INTERVAL_MS / 1000)
+        await flush_all()
+
+
+# --- 익명 메시지 로그 전송 큐 ---
+# 명령어는 큐에 넣기만 하고 바로 응답하며, 백그라운드 작업이 로그를 모아
+# 메시지 하나에 임베드 최대 10개씩 보냅니다. 실패하면 점점 길게 기다렸다가 다시 보냅니다.
+LOG_FIELD_MAX = 1024  # 임베드 필드 값 최대 길이
+LOG_MESSAGE_CHARS = 6000  # 메시지 하나에 들어가는 임베드 글자 수 합계 최대
+
+
+def anonymous_log_embed(entry):
+    content = entry["content"]
+    limit = LOG_FIELD_MAX - len("``````")
+    if len(content) > limit:
+        content = content[:limit - 1] + "…"  # 전체 내용은 로컬 로그 파일에
+    embed = nextcord.Embed(title="🗒️ 익명 메시지 로그", color=0x888888)
+    embed.add_field(name="보낸 시각", value=f"`{entry['time']}`", inline=False)
+    embed.add_field(name="닉네임", value=f"`{entry['nickname']}`", inline=True)
+    embed.add_field(name="유저 ID", value=f"`{entry['user_id']}`", inline=True)
+    embed.add_field(name="내용", value=f"```{content}```", inline=False)
+    embed.set_footer(text="익명 시스템 로그")
+    return embed
+
+
+class LogQueue:
+    MAX_EMBEDS = 10  # 디스코드 메시지 하나에 넣을 수 있는 임베드 수
+
+    def __init__(self, channel_id, path):
+        self.channel_id = channel_id
+        self.path = path
+        self.queue = asyncio.Queue()
+
+    def put(self, entry):
+        self.queue.put_nowait(entry)
+
+    def _append_file(self, batch):
+        with open(self.path, "a", encoding="utf-8") as f:
+            for entry in batch:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    async def _next_batch(self):
+        batch = [await self.queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + LOG_BATCH_WAIT
+        while len(batch) < self.MAX_EMBEDS:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    def _pack(self, batch):
+        """임베드 수(MAX_EMBEDS)와 글자 수 합계(LOG_MESSAGE_CHARS) 안에 들어가도록 메시지 단위로 나눕니다."""
+        messages, current, size = [], [], 0
+        for entry in batch:
+            embed = anonymous_log_embed(entry)
+            if current and (len(current) == self.MAX_EMBEDS or size + len(embed) > LOG_MESSAGE_CHARS):
+                messages.append(current)
+                current, size = [], 0
+            current.append(embed)
+            size += len(embed)
+        if current:
+            messages.append(current)
+        return messages
+
+    async def _send(self, embeds):
+        for attempt in range(LOG_MAX_RETRIES):
+            channel = bot.get_channel(self.channel_id)
+            if channel is None:
+                print(f"익명 로그 채널({self.channel_id})을 찾을 수 없습니다. 로컬 로그에만 남깁니다.")
+                return
+            try:
+                await channel.send(embeds=embeds)
+                return
+            except nextcord.HTTPException as e:
+                if e.status < 500 and e.status != 429:
+                    print(f"익명 로그 전송 실패 (재시도 안 함): {e}")
+                    return
+            except (OSError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                print(f"익명 로그 전송 실패 (다시 시도): {e!r}")
+            await asyncio.sleep(min(2 ** attempt, 30))
+        print(f"익명 로그 {len(embeds)}건 전송 포기. 로컬 로그에는 남아 있습니다.")
+
+    async def run(self):
+        while True:
+            batch = await self._next_batch()
+            try:
+                try:
+                    await asyncio.to_thread(self._append_file, batch)
+                except Exception as e:
+                    print(f"익명 로그 파일 저장 실패: {e}")
+                for embeds in self._pack(batch):
+                    await self._send(embeds)
+            except Exception as e:
+                # 예상 못 한 오류로 작업이 죽으면 그 뒤 로그가 파일에도 남지 않으므로 이번 묶음만 포기
+                print(f"익명 로그 전송 중 오류: {e!r}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def drain(self, timeout):
+        """종료 전에 큐에 남은 로그를 timeout초까지 보내고, 못 보낸 것은 파일에라도 남깁니다."""
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+            return
+        except asyncio.TimeoutError:
+            pass
+        left = []
+        while not self.queue.empty():
+            left.append(self.queue.get_nowait())
+            self.queue.task_done()
+        if left:
+            self._append_file(left)
+            print(f"익명 로그 {len(left)}건은 보내지 못하고 로컬 로그에만 남겼습니다.")
+
+
+anonymous_logs = LogQueue(ANON_LOG_CHANNEL_ID, ANON_LOG_FILE)
+
+
+# --- 잔액 원장 압축 ---
+async def ledger_compact_loop():
+    while True:
+        await asyncio.sleep(LEDGER_COMPACT_INTERVAL)
+        await flush_all()
+        cutoff = int(time.time()) - LEDGER_RETENTION_DAYS * 24 * 60 * 60
+        post_cutoff = int(time.time()) - POST_RETENTION_DAYS * 24 * 60 * 60
+        for partition in partitions:
+            try:
+                await partition.db.compact_ledger(cutoff)
+                await partition.db.prune_posts(post_cutoff)
+            except Exception as e:
+                print(f"원장 압축 실패 ({partition.path}): {e}")
+
+
+# --- DB 백업 ---
+# 파일을 그냥 복사하면 쓰는 도중의 내용이 섞이므로 SQLite 백업 API로 복사합니다.
+# 별도 스레드에서 자기 연결로 BACKUP_PAGES씩 나눠 복사하므로 이벤트 루프와 DB 스레드를 막지 않습니다.
+class _BackupRestarted(Exception):
+    pass
+
+
+def _copy_database(src, dst):
+    last_remaining = None
+    restarts = 0
+
+    def progress(status, remaining, total):
+        nonlocal last_remaining, restarts
+        # 다른 연결이 쓰면 SQLite가 복사를 처음부터 다시 시작함 (남은 페이지 수가 늘어남)
+        if last_remaining is not None and remaining > last_remaining:
+            restarts += 1
+            if restarts > BACKUP_MAX_RESTARTS:
+                raise _BackupRestarted()
+        last_remaining = remaining
+        time.sleep(BACKUP_STEP_SLEEP)
+
+    try:
+        src.backup(dst, pages=BACKUP_PAGES, progress=progress)
+    except _BackupRestarted:
+        # 쓰기가 잦아 끝나지 않으면 한 단계로 복사 (WAL이라 그동안에도 쓰기는 막히지 않음)
+        src.backup(dst)
+
+
+def _backup_prefix(db_path):
+    return os.path.splitext(os.path.basename(db_path))[0] + "-"
+
+
+def list_backups(db_path, backup_dir=BACKUP_DIR):
+    """db_path의 백업 파일 이름 목록 (오래된 순)"""
+    if not os.path.isdir(backup_dir):
+        return []
+    prefix = _backup_prefix(db_path)
+    return sorted(name for name in os.listdir(backup_dir) if name.startswith(prefix) and name.endswith(".db.gz"))
+
+
+def backup_database(db_path, backup_dir=BACKUP_DIR):
+    """db_path를 backup_dir에 gzip으로 백업하고 오래된 백업을 지운 뒤 새 파일 경로를 반환합니다."""
+    os.makedirs(backup_dir, exist_ok=True)
+    name = f"{_backup_prefix(db_path)}{datetime.now():%Y%m%d-%H%M%S}.db"
+    tmp_path = os.path.join(backup_dir, f".{name}")
+    out_path = os.path.join(backup_dir, f"{name}.gz")
+    src = sqlite3.connect(db_path)
+    dst = sqlite3.connect(tmp_path)
+    try:
+        _copy_database(src, dst)
+        result = dst.execute("PRAGMA quick_check").fetchone()[0]
+        if result != "ok":
+            raise RuntimeError(f"백업 파일 검사 실패: {result}")
+    finally:
+        src.close()
+        dst.close()
+    try:
+        with open(tmp_path, "rb") as f_in, gzip.open(f"{out_path}.tmp", "wb") as f_out:
+            shutil.copyfileobj(f_in, f_out)
+        os.replace(f"{out_path}.tmp", out_path)
+    finally:
+        os.remove(tmp_path)
+    for old in list_backups(db_path, backup_dir)[:-BACKUP_KEEP]:
+        os.remove(os.path.join(backup_dir, old))
+    return out_path
+
+
+def _unpack_backup(backup_path, tmp_dir):
+    db_path = os.path.join(tmp_dir, "restore.db")
+    with gzip.open(backup_path, "rb") as f_in, open(db_path, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    return db_path
+
+
+def verify_backup(backup_path):
+    """백업 파일을 풀어 무결성 검사를 하고 (결과, 스키마 버전, 유저 수) 를 반환합니다."""
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite3.connect(_unpack_backup(backup_path, tmp))
+        try:
+            result = conn.execute("PRAGMA integrity_check").fetchone()[0]
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            users = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+        finally:
+            conn.close()
+    return result, version, users
+
+
+async def restore_backup(partition, backup_path):
+    """backup_path로 partition의 DB를 되돌립니다. 되돌리기 전의 상태도 백업해 둡니다."""
+    with tempfile.TemporaryDirectory() as tmp:
+        # 되돌리기 전 백업이 오래된 백업을 지울 수 있으므로 먼저 풀어 둠
+        src_path = await asyncio.to_thread(_unpack_backup, backup_path, tmp)
+        await flush_all()
+        await asyncio.to_thread(backup_database, partition.path)
+
+        # 실제 DB에 쓰는 연결(DB 스레드)로 덮어써야 다른 연결도 바뀐 내용을 봄
+        def op(conn):
+            src = sqlite3.connect(src_path)
+            try:
+                src.backup(conn)
+            finally:
+                src.close()
+        await partition.db.call(op)
+    await asyncio.to_thread(init_db, partition.path)  # 예전 스키마의 백업이면 마이그레이션
+    # 복원 전의 변경이 다음 시작 때 복원된 DB에 다시 적용되지 않도록 저널을 지금 번호까지 끝난 것으로 기록
+    seq, segments = partition.users.journal.rotate()
+    await partition.db.write_users([], (), seq)
+    IntentJournal.discard(segments)
+    await partition.reset()
+    await custom_replies.reload()
+
+
+async def backup_all():
+    await flush_all()
+    for partition in partitions:
+        try:
+            path = await asyncio.to_thread(backup_database, partition.path)
+            print(f"DB 백업 완료: {path}")
+        except Exception as e:
+            print(f"DB 백업 실패 ({partition.path}): {e}")
+
+
+async def backup_loop():
+    while True:
+        await asyncio.sleep(BACKUP_INTERVAL)
+        await backup_all()
+
+
+# --- 백그라운드 작업 ---
+background_tasks = []
+
+
+def start_background_tasks():
+    # on_ready는 재연결 때마다 다시 호출되므로 한 번만 시작
+    if background_tasks:
+        return
+    loop = asyncio.get_running_loop()
+    for job in (flush_loop, loop_lag_monitor, metrics_file_loop, anonymous_logs.run, ledger_compact_loop, backup_loop):
+        background_tasks.append(loop.create_task(job(), name=job.__name__))
+    lifecycle.install_signal_handlers()
+
+
+# --- 종료 처리 ---
+# SIGTERM/SIGINT를 받으면 새 명령어는 거절하고, 처리 중인 명령어가 끝나기를 SHUTDOWN_DRAIN_TIMEOUT초까지 기다립니다.
+# 그다음 남은 익명 로그를 보내고, 캐시를 저장하고, WAL을 DB 파일에 합친 뒤 연결을 끊습니다.
+# 신호를 한 번 더 받으면 기다리지 않고 바로 끝냅니다 (저장 못 한 변경은 다음 시작 때 저널에서 복구).
+class Lifecycle:
+    def __init__(self):
+        self.stopping = False
+        self.inflight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._task = None
+
+    def enter(self):
+        self.inflight += 1
+        self._idle.clear()
+
+    def leave(self):
+        self.inflight -= 1
+        if self.inflight == 0:
+            self._idle.set()
+
+    def install_signal_handlers(self):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, self.request_shutdown, sig.name)
+            except NotImplementedError:  # 윈도우: nextcord 기본 처리 후 finally에서 저장
+                return
+
+    def request_shutdown(self, reason):
+        if self.stopping:
+            print(f"{reason}: 기다리지 않고 바로 종료합니다.")
+            asyncio.get_running_loop().stop()
+            return
+        self._task = asyncio.get_running_loop().create_task(self.shutdown(reason))
+
+    async def shutdown(self, reason):
+        self.stopping = True
+        print(f"{reason}: 종료를 시작합니다. (처리 중인 명령어 {self.inflight}개)")
+        try:
+            await asyncio.wait_for(self._idle.wait(), SHUTDOWN_DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            print(f"명령어 {self.inflight}개가 {SHUTDOWN_DRAIN_TIMEOUT:g}초 안에 끝나지 않아 기다리지 않고 진행합니다.")
+        await anonymous_logs.drain(SHUTDOWN_LOG_TIMEOUT)
+        for task in background_tasks:
+            if task.get_name() != "flush_loop":  # flush_loop는 stopping을 보고 지금 하던 저장까지 마치고 끝남
+                task.cancel()
+        await asyncio.gather(*background_tasks, return_exceptions=True)
+        await flush_all()
+        for partition in partitions:
+            try:
+                await partition.db.checkpoint()
+            except Exception as e:
+                print(f"WAL 체크포인트 실패 ({partition.path}): {e}")
+        print("저장을 마쳤습니다. 연결을 끊습니다.")
+        await bot.close()
+
+
+lifecycle = Lifecycle()
+
+
+# --- 이벤트/게시물 결과 표 ---
+# events.json을 한 번 읽어 검사한 뒤 alias 표로 바꿔 두고, 뽑을 때마다 O(1)로 고릅니다.
+# /설정다시불러오기로 재시작 없이 바꿀 수 있으며, 새 파일에 문제가 있으면 기존 표를 그대로 씁니다.
+class AliasSampler:
+    """Vose의 alias 방법. 만들 때 O(n), 뽑을 때 난수 두 개로 O(1)"""
+
+    def __init__(self, items, weights):
+        n = len(items)
+        total = sum(weights)
+        scaled = [w * n / total for w in weights]
+        self.items = list(items)
+        self.prob = [0.0] * n
+        self.alias = list(range(n))
+        small = [i for i, p in enumerate(scaled) if p < 1]
+        large = [i for i, p in enumerate(scaled) if p >= 1]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] -= 1 - scaled[s]
+            (small if scaled[l] < 1 else large).append(l)
+        for i in small + large:  # 부동소수점 오차로 남은 칸은 1
+            self.prob[i] = 1.0
+
+    def sample(self, rng=random):
+        i = int(rng.random() * len(self.items))
+        return self.items[i] if rng.random() < self.prob[i] else self.items[self.alias[i]]
+
+
+class GameConfig:
+    def __init__(self, events, posts):
+        self.events = events  # [{"name", "weight", "deltas", "reset", "quiet"}, ...]
+        self.posts = posts  # [{"name", "weight", "deltas", "message", "reasons"}, ...]
+        self.event_sampler = AliasSampler(events, [e["weight"] for e in events])
+        self.post_sampler = AliasSampler(posts, [p["weight"] for p in posts])
+
+
+def _check_entries(entries, section, extra_keys):
+    """공통 항목(name, weight, 스탯)을 검사해 정리한 목록을 반환합니다. 틀리면 ValueError"""
+    if not isinstance(entries, list) or not entries:
+        raise ValueError(f"{section}: 항목이 하나 이상 있어야 합니다.")
+    result = []
+    for n, entry in enumerate(entries, start=1):
+        where = f"{section} {n}번째 항목"
+        if not isinstance(entry, dict):
+            raise ValueError(f"{where}: 객체여야 합니다.")
+        unknown = entry.keys() - {"name", "weight", *GAME_STATS, *extra_keys}
+        if unknown:
+            raise ValueError(f"{where}: 알 수 없는 키 {sorted(unknown)}")
+        if not isinstance(entry.get("name"), str) or not entry["name"].strip():
+            raise ValueError(f"{where}: name이 비어 있습니다.")
+        weight = entry.get("weight")
+        if isinstance(weight, bool) or not isinstance(weight, (int, float)) or not weight > 0:
+            raise ValueError(f"{where} ({entry['name']}): weight는 0보다 큰 숫자여야 합니다.")
+        deltas = {}
+        for col in GAME_STATS:
+            value = entry.get(col, 0)
+            if isinstance(value, bool) or not isinstance(value, int):
+                raise ValueError(f"{where} ({entry['name']}): {col}은 정수여야 합니다.")
+            if value:
+                deltas[col] = value
+        result.append({**{key: entry[key] for key in extra_keys if key in entry},
+                       "name": entry["name"], "weight": float(weight), "deltas": deltas})
+    return result
+
+
+def load_game_config(path=GAME_CONFIG_FILE):
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+
+    events = _check_entries(data.get("events"), "events", ["reset", "quiet"])
+    for event in events:
+        event["reset"] = event.get("reset", False)
+        event["quiet"] = event.get("quiet")
+        if not isinstance(event["reset"], bool) or (event["reset"] and event["deltas"]):
+            raise ValueError(f"events ({event['name']}): reset은 true/false이고, 스탯 변화량과 같이 쓸 수 없습니다.")
+        if event["quiet"] is not None and not isinstance(event["quiet"], str):
+            raise ValueError(f"events ({event['name']}): quiet는 문자열이어야 합니다.")
+
+    posts = _check_entries(data.get("posts"), "posts", ["message", "reasons"])
+    for post in posts:
+        reasons = post.get("reasons")
+        if not isinstance(reasons, list) or not reasons or not all(isinstance(r, str) and r for r in reasons):
+            raise ValueError(f"posts ({post['name']}): reasons는 비어 있지 않은 문자열 목록이어야 합니다.")
+        if not isinstance(post.get("message"), str):
+            raise ValueError(f"posts ({post['name']}): message가 없습니다.")
+        try:
+            post["message"].format(reason=reasons[0])
+        except (KeyError, IndexError, ValueError) as e:
+            raise ValueError(f"posts ({post['name']}): message에는 {{reason}}만 쓸 수 있습니다. ({e})")
+
+    return GameConfig(events, posts)
+
+
+game_config = load_game_config()
+
+
+def feed_title(user):
+    for col, threshold, title in FEED_TITLES:
+        if (user[col] or 0) >= threshold:
+            return title
+    return DEFAULT_FEED_TITLE
+
+
+# --- 오늘 출석 여부 ---
+def not_checked_in_today(row):
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
+    return row["last_checkin_time"] is None or row["last_checkin_time"] < today
+
 
 
 # --- 가입 명령어 ---
-@bot.slash_command(name="가입", description="디스타그램에 가입합니다.")
+@bot.slash_command(name="가입", description="디스타그램에 가입합니다.", dm_permission=False)
 async def 가입(interaction: Interaction):
-    user_id = str(interaction.user.id)
+    store, key = storage(interaction)
     name = interaction.user.name
 
-    if user_exists(user_id):
+    if await store.users.get(key) is not None:
         await interaction.response.send_message("이미 가입되어 있습니다!", ephemeral=True)
         return
 
-    add_user(user_id, name)
+    await store.db.add_user(*key, name)
+    store.leaderboards.on_change(key, {"name": name, **{col: 0 for col in RANKING_STATS}})
     await interaction.response.send_message(f"환영합니다, {name}님! 디스타그램에 가입 완료되었습니다.", ephemeral=True)
 
 
 # --- 탈퇴 명령어 ---
-@bot.slash_command(name="탈퇴", description="디스타그램에서 탈퇴합니다.")
+@bot.slash_command(name="탈퇴", description="디스타그램에서 탈퇴합니다.", dm_permission=False)
 async def 탈퇴(interaction: Interaction):
-    user_id = str(interaction.user.id)
+    store, key = storage(interaction)
 
-    if not user_exists(user_id):
+    if await store.users.get(key) is None:
         await interaction.response.send_message("가입되어 있지 않습니다.", ephemeral=True)
         return
 
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("DELETE FROM users WHERE user_id = ?", (user_id,))
-    conn.commit()
-    conn.close()
+    store.users.discard(key)
+    store.leaderboards.remove(key)
+    followees, followers = await store.db.delete_user(*key)
+    # 상대방 팔로우 수는 DB에서 이미 줄였으므로 메모리에 있는 행에만 반영
+    store.users.shift("follower", -1, key[0], followees)
+    store.users.shift("following", -1, key[0], followers)
+    store.timelines.invalidate(guild_id=key[0])
 
     await interaction.response.send_message("탈퇴가 완료되었습니다. 다시 만날 날을 기다릴게요!", ephemeral=True)
 
 
 
-@bot.slash_command(name="타임아웃", description="선택한 유저를 타임아웃합니다.", default_member_permissions=nextcord.Permissions(administrator=True))
+@bot.slash_command(name="타임아웃", description="선택한 유저를 타임아웃합니다.", dm_permission=False, default_member_permissions=nextcord.Permissions(administrator=True))
 async def timeout_user(ctx: nextcord.Interaction,
                        멤버: nextcord.Member=nextcord.SlashOption(description="멤버를 입력하세요."),
                        시간: int=nextcord.SlashOption(description="시간을 입력하세요. (분 단위)")):
@@ -133,7 +2310,7 @@ async def timeout_user(ctx: nextcord.Interaction,
 
 
 
-@bot.slash_command(name="추방", description="유저를 추방함", default_member_permissions=nextcord.Permissions(administrator=True))
+@bot.slash_command(name="추방", description="유저를 추방함", dm_permission=False, default_member_permissions=nextcord.Permissions(administrator=True))
 async def kick(ctx: nextcord.Interaction, 
                멤버: nextcord.Member = nextcord.SlashOption(description="추방할 멤버를 골라주세요.", required=True),
                사유: str = nextcord.SlashOption(description="사유를 적어주세요", required=False)):
@@ -153,7 +2330,7 @@ async def kick(ctx: nextcord.Interaction,
 
 
 
-@bot.slash_command(name="서버차단", description="유저를 영구차단함", default_member_permissions=nextcord.Permissions(administrator=True))
+@bot.slash_command(name="서버차단", description="유저를 영구차단함", dm_permission=False, default_member_permissions=nextcord.Permissions(administrator=True))
 async def ban(ctx: nextcord.Interaction, 
               멤버: nextcord.Member = nextcord.SlashOption(description="서버에서 차단할 멤버를 골라주세요.", required=True),
               사유: str = nextcord.SlashOption(description="사유를 적어주세요", required=False)):
@@ -173,7 +2350,7 @@ async def ban(ctx: nextcord.Interaction,
 
 
 
-@bot.slash_command(name="메시지삭제", description="입력한 개수만큼 메시지를 삭제합니다.", default_member_permissions=nextcord.Permissions(administrator=True))
+@bot.slash_command(name="메시지삭제", description="입력한 개수만큼 메시지를 삭제합니다.", dm_permission=False, default_member_permissions=nextcord.Permissions(administrator=True))
 async def delete_messages(
     ctx: nextcord.Interaction,
     개수: int = nextcord.SlashOption(description="삭제할 메시지 개수를 입력하세요.", min_value=1, max_value=100)
@@ -196,19 +2373,151 @@ async def delete_messages(
 
 
 
+# --- 메시지 대량 삭제 ---
+# 채널 기록을 100개씩 받아오며 조건에 맞는 메시지를 모아 100개씩 bulk delete 합니다.
+# 한 번에 들고 있는 메시지는 최대 100개이고, 14일이 넘은 메시지는 간격을 두고 하나씩 지웁니다.
+def parse_purge_time(text):
+    """'YYYY-MM-DD HH:MM' (서버 컴퓨터 시간대) 를 datetime으로. 비어 있으면 None"""
+    if not text:
+        return None
+    return datetime.strptime(text.strip(), "%Y-%m-%d %H:%M").astimezone()
+
+
+async def purge_channel(channel, limit, check, after=None, before=None, on_progress=None):
+    """조건에 맞는 메시지를 최대 limit개 지우고 (검사한 수, 지운 수, 하나씩 지운 수) 를 반환합니다.
+    on_progress(검사한 수, 지운 수)는 PURGE_PROGRESS_INTERVAL마다 호출됩니다."""
+    loop = asyncio.get_running_loop()
+    bulk_cutoff = datetime.now().astimezone() - PURGE_BULK_MAX_AGE
+    scanned = deleted = single = 0
+    batch = []
+    next_report = loop.time() + PURGE_PROGRESS_INTERVAL
+
+    async def report():
+        nonlocal next_report
+        if on_progress is not None and loop.time() >= next_report:
+            next_report = loop.time() + PURGE_PROGRESS_INTERVAL
+            await on_progress(scanned, deleted)
+
+    async for message in channel.history(limit=None, after=after, before=before, oldest_first=False):
+        if deleted + len(batch) >= limit:
+            break
+        scanned += 1
+        if message.pinned or not check(message):
+            await report()
+            continue
+        if message.created_at >= bulk_cutoff:
+            batch.append(message)
+            if len(batch) >= PURGE_BATCH_SIZE:
+                await channel.delete_messages(batch)
+                deleted += len(batch)
+                batch = []
+        else:
+            # 최신 순으로 읽으므로 여기부터는 전부 14일이 넘은 메시지
+            if batch:
+                await channel.delete_messages(batch)
+                deleted += len(batch)
+                batch = []
+            try:
+                await message.delete()
+                deleted += 1
+                single += 1
+            except nextcord.NotFound:
+                pass  # 그 사이 누가 지움
+            await asyncio.sleep(PURGE_SINGLE_DELAY)
+        await report()
+    if batch:
+        await channel.delete_messages(batch)
+        deleted += len(batch)
+    return scanned, deleted, single
+
+
+@bot.slash_command(name="메시지대량삭제", description="조건에 맞는 메시지를 수천 개까지 삭제합니다.", dm_permission=False, default_member_permissions=nextcord.Permissions(administrator=True))
+async def purge_messages(
+    ctx: nextcord.Interaction,
+    개수: int = nextcord.SlashOption(description="삭제할 최대 메시지 개수를 입력하세요.", min_value=1, max_value=PURGE_MAX),
+    작성자: nextcord.Member = nextcord.SlashOption(description="이 멤버가 보낸 메시지만 삭제합니다.", required=False),
+    포함문구: str = nextcord.SlashOption(description="이 문구가 들어간 메시지만 삭제합니다.", required=False),
+    시작: str = nextcord.SlashOption(description="이 시각 이후 메시지만 (예: 2025-06-01 13:00)", required=False),
+    끝: str = nextcord.SlashOption(description="이 시각 이전 메시지만 (예: 2025-06-01 18:00)", required=False)
+):
+    if not (ctx.user.guild_permissions.administrator or ctx.guild.owner_id == ctx.user.id):
+        await ctx.response.send_message("❌ 관리자만 사용할 수 있는 명령어입니다.", ephemeral=True)
+        return
+    permissions = ctx.channel.permissions_for(ctx.guild.me)
+    if not (permissions.manage_messages and permissions.read_message_history):
+        await ctx.response.send_message("❌ 봇에게 '메시지 관리'와 '메시지 기록 보기' 권한이 필요합니다.", ephemeral=True)
+        return
+    try:
+        after, before = parse_purge_time(시작), parse_purge_time(끝)
+    except ValueError:
+        await ctx.response.send_message("❌ 시각은 `2025-06-01 13:00` 형식으로 입력해주세요.", ephemeral=True)
+        return
+
+    await ctx.response.defer(ephemeral=True)
+    # 명령어 이후에 올라온 메시지(진행 상황 메시지 포함)는 건드리지 않음
+    before = min(before, ctx.created_at) if before else ctx.created_at
+    keyword = 포함문구.lower() if 포함문구 else None
+
+    def check(message):
+        if 작성자 is not None and message.author.id != 작성자.id:
+            return False
+        return keyword is None or keyword in message.content.lower()
+
+    progress = await ctx.followup.send("🧹 메시지를 찾는 중입니다...", wait=True)
+    reporting = True
+
+    def can_edit():
+        # 오래된 메시지를 하나씩 지우면 15분을 넘길 수 있고, 그 뒤에는 응답 메시지를 고칠 수 없음
+        return datetime.now().astimezone() - ctx.created_at < INTERACTION_EDIT_TTL
+
+    async def on_progress(scanned, deleted):
+        nonlocal reporting
+        if not reporting or not can_edit():
+            return
+        try:
+            await progress.edit(content=f"🧹 삭제 중... 확인한 메시지 {scanned:,}개 · 삭제 {deleted:,}개")
+        except nextcord.HTTPException:
+            reporting = False  # 진행 상황을 못 보여줘도 삭제는 계속
+
+    async def finish(text):
+        if can_edit():
+            try:
+                await progress.edit(content=text)
+                return
+            except nextcord.HTTPException:
+                pass
+        # 응답 메시지를 고칠 수 없으면 채널에 결과를 남김
+        try:
+            await ctx.channel.send(f"{ctx.user.mention} {text}")
+        except nextcord.HTTPException as e:
+            print(f"/메시지대량삭제 결과를 알리지 못했습니다: {text} ({e})")
+
+    try:
+        scanned, deleted, single = await purge_channel(ctx.channel, 개수, check, after, before, on_progress)
+    except nextcord.Forbidden:
+        await finish("❌ 메시지 삭제 권한이 부족합니다.")
+        return
+    except Exception as e:
+        await finish(f"❌ 메시지 삭제 중 오류가 발생했습니다.: {e}")
+        return
+
+    text = f"✅ 메시지 {deleted:,}개를 삭제했습니다. (확인한 메시지 {scanned:,}개)"
+    if single:
+        text += f"\n14일이 지난 메시지 {single:,}개는 하나씩 삭제했습니다."
+    await finish(text)
+
+
+
 # --- 잔액 조회 ---
-@bot.slash_command(name="잔액", description="잔액을 알려줍니다.")
+@bot.slash_command(name="잔액", description="잔액을 알려줍니다.", dm_permission=False)
 async def 잔액(interaction: Interaction):
-    user_id = str(interaction.user.id)
-    if not user_exists(user_id):
+    store, key = storage(interaction)
+    user = await store.users.get(key)
+    if user is None:
         await interaction.response.send_message("가입을 해주세요.", ephemeral=True)
         return
 
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("SELECT balance FROM users WHERE user_id = ?", (user_id,))
-    balance = c.fetchone()[0]
-    conn.close()
+    balance = user["balance"]
 
     embed = nextcord.Embed(
         title=f"{interaction.user.name}",
@@ -220,47 +2529,26 @@ async def 잔액(interaction: Interaction):
 
 
 
-@bot.slash_command(name="출석", description="출석하고 보상을 받아가세요! (하루 1회)")
+@bot.slash_command(name="출석", description="출석하고 보상을 받아가세요! (하루 1회)", dm_permission=False)
 async def 출석(interaction: Interaction):
     await interaction.response.defer(ephemeral=True)  # thinking 방지
 
-    user_id = str(interaction.user.id)
+    store, key = storage(interaction)
     name = interaction.user.name
 
-    if not user_exists(user_id):
+    user = await store.users.get(key)
+    if user is None:
         await interaction.followup.send("❗가입하지 않은 사용자입니다. 먼저 가입해주세요.")
         return
 
-    now = datetime.now()
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-
-    c.execute("SELECT balance, last_checkin_time FROM users WHERE user_id = ?", (user_id,))
-    result = c.fetchone()
-    balance = result[0] or 0
-    last_checkin_time = result[1]
-
-    already_checked_in = False
-    if last_checkin_time:
-        try:
-            last_time = datetime.strptime(last_checkin_time, "%Y-%m-%d %H:%M:%S")
-            if last_time.date() == now.date():
-                already_checked_in = True
-        except Exception:
-            pass  # 잘못된 값이면 무시
-
-    if already_checked_in:
+    reward = 100
+    user = store.users.apply(key, {"balance": reward}, when=not_checked_in_today, reason="출석 보상",
+                             last_checkin_time=int(time.time()))
+    if user is None:
         await interaction.followup.send("📅 이미 오늘 출석하셨습니다!")
-        conn.close()
         return
 
-    reward = 100
-    balance += reward
-
-    c.execute("UPDATE users SET balance = ?, last_checkin_time = ? WHERE user_id = ?",
-              (balance, now.strftime("%Y-%m-%d %H:%M:%S"), user_id))
-    conn.commit()
-    conn.close()
+    balance = user["balance"]
 
     embed = nextcord.Embed(title="✅ 출석 완료!", color=0x76FF7A)
     embed.add_field(name="출석자", value=name, inline=True)
@@ -272,18 +2560,13 @@ async def 출석(interaction: Interaction):
 
 
 
-@bot.slash_command(name="잔액랭킹", description="상위 5명의 잔액 랭킹을 확인합니다.")
+@bot.slash_command(name="잔액랭킹", description="상위 5명의 잔액 랭킹을 확인합니다.", dm_permission=False)
 async def 잔액랭킹(interaction: Interaction):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-
-    c.execute("SELECT name, balance FROM users ORDER BY balance DESC LIMIT 5")
-    top_users = c.fetchall()
-    conn.close()
+    top_users = await partition_for(interaction.guild_id).leaderboards.page(str(interaction.guild_id), "balance", 5)
 
     embed = nextcord.Embed(title="💰 잔액 랭킹 TOP 5", color=0xFFD700)
 
-    for idx, (name, balance) in enumerate(top_users, start=1):
+    for idx, (_, name, balance) in enumerate(top_users, start=1):
         embed.add_field(
             name=f"{idx}위 - {name}",
             value=f"잔액: {balance:,}원",
@@ -293,9 +2576,58 @@ async def 잔액랭킹(interaction: Interaction):
     await interaction.response.send_message(embed=embed)
 
 
+# --- 랭킹 (페이지 넘김) ---
+class RankingView(nextcord.ui.View):
+    def __init__(self, guild_id, column):
+        super().__init__(timeout=180)
+        self.guild_id = str(guild_id)
+        self.column = column
+        self.start_rank = 1
+        self.rows = []
+
+    async def load(self, after=None, start_rank=1):
+        leaderboards = partition_for(self.guild_id).leaderboards
+        self.rows = await leaderboards.page(self.guild_id, self.column, RANKING_PAGE_SIZE, after)
+        self.start_rank = start_rank
+        self.next_button.disabled = len(self.rows) < RANKING_PAGE_SIZE
+        self.first_button.disabled = start_rank == 1
+
+    def embed(self):
+        label = RANKING_STATS[self.column]
+        end_rank = self.start_rank + max(len(self.rows), 1) - 1
+        embed = nextcord.Embed(title=f"🏆 {label} 랭킹 ({self.start_rank}~{end_rank}위)", color=0xFFD700)
+        if not self.rows:
+            embed.description = "더 이상 순위가 없습니다."
+        for idx, (_, name, value) in enumerate(self.rows, start=self.start_rank):
+            embed.add_field(name=f"{idx}위 - {name}", value=f"{label}: {value:,}", inline=False)
+        return embed
+
+    @nextcord.ui.button(label="◀ 처음", style=nextcord.ButtonStyle.secondary)
+    async def first_button(self, button: nextcord.ui.Button, interaction: Interaction):
+        await self.load()
+        await interaction.response.edit_message(embed=self.embed(), view=self)
+
+    @nextcord.ui.button(label="다음 ▶", style=nextcord.ButtonStyle.primary)
+    async def next_button(self, button: nextcord.ui.Button, interaction: Interaction):
+        user_id, _, value = self.rows[-1]
+        await self.load(after=(value, user_id), start_rank=self.start_rank + len(self.rows))
+        await interaction.response.edit_message(embed=self.embed(), view=self)
+
+
+@bot.slash_command(name="랭킹", description="잔액/팔로워/좋아요/싫어요 랭킹을 페이지별로 확인합니다.", dm_permission=False)
+async def 랭킹(
+    interaction: Interaction,
+    종류: str = nextcord.SlashOption(description="랭킹 종류를 선택하세요.",
+                                   choices={label: col for col, label in RANKING_STATS.items()})
+):
+    view = RankingView(interaction.guild_id, 종류)
+    await view.load()
+    await interaction.response.send_message(embed=view.embed(), view=view)
+
+
 
 # --- 잔액 변경 (관리자만) ---
-@bot.slash_command(name="잔액변경", description="유저의 잔액을 변경할 수 있습니다.", default_member_permissions=nextcord.Permissions(administrator=True))
+@bot.slash_command(name="잔액변경", description="유저의 잔액을 변경할 수 있습니다.", dm_permission=False, default_member_permissions=nextcord.Permissions(administrator=True))
 async def 잔액변경(
     interaction: Interaction,
     유저: nextcord.Member = nextcord.SlashOption(description="유저를 선택하세요."),
@@ -306,19 +2638,14 @@ async def 잔액변경(
         await interaction.response.send_message("관리자만 사용할 수 있는 명령어입니다.", ephemeral=True)
         return
 
-    user_id = str(유저.id)
-    if not user_exists(user_id):
+    store, key = storage(interaction, 유저)
+    user = await store.users.get(key)
+    if user is None:
         await interaction.response.send_message("❌ 가입이 되어있지 않거나 존재하지 않는 유저입니다.", ephemeral=True)
         return
 
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("SELECT balance FROM users WHERE user_id = ?", (user_id,))
-    current_balance = c.fetchone()[0] or 0
-    new_balance = current_balance + 변경할금액
-    c.execute("UPDATE users SET balance = ? WHERE user_id = ?", (new_balance, user_id))
-    conn.commit()
-    conn.close()
+    new_balance = store.users.apply(key, {"balance": 변경할금액}, reason=사유,
+                                    actor_id=str(interaction.user.id))["balance"]
 
     embed = nextcord.Embed(
         title=f"{interaction.user.name}님의 요청",
@@ -331,98 +2658,387 @@ async def 잔액변경(
     await interaction.response.send_message(embed=embed)
 
 
-# --- 게시물 올리기 (쿨타임 15초) ---
-@bot.slash_command(name="게시물올리기", description="디스타그램에 게시물을 올립니다.")
-async def 게시물올리기(interaction: Interaction):
-    user_id = str(interaction.user.id)
-    if not user_exists(user_id):
-        await interaction.response.send_message("❗가입하지 않은 사용자입니다.", ephemeral=True)
+# --- 잔액 일괄 변경 (관리자만) ---
+@bot.slash_command(name="잔액일괄변경", description="역할/여러 유저/전체 유저의 잔액을 한 번에 변경합니다.", dm_permission=False, default_member_permissions=nextcord.Permissions(administrator=True))
+async def 잔액일괄변경(
+    interaction: Interaction,
+    사유: str = nextcord.SlashOption(description="변경 사유를 입력하세요."),
+    변경할금액: int = nextcord.SlashOption(description="유저 한 명당 변경할 금액을 입력하세요."),
+    역할: nextcord.Role = nextcord.SlashOption(description="이 역할을 가진 멤버 전체", required=False),
+    유저목록: str = nextcord.SlashOption(description="멘션 또는 유저 ID를 공백으로 구분해 입력하세요.", required=False),
+    전체: bool = nextcord.SlashOption(description="가입한 모든 유저", required=False, default=False)
+):
+    if not (interaction.user.guild_permissions.administrator or interaction.guild.owner_id == interaction.user.id):
+        await interaction.response.send_message("관리자만 사용할 수 있는 명령어입니다.", ephemeral=True)
+        return
+    if sum([역할 is not None, bool(유저목록), bool(전체)]) != 1:
+        await interaction.response.send_message("❌ 역할, 유저목록, 전체 중 하나만 선택해주세요.", ephemeral=True)
         return
 
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("SELECT follower, like, hate, last_post_time FROM users WHERE user_id = ?", (user_id,))
-    result = c.fetchone()
-    follower, like, hate, last_post_time = result if result else (0, 0, 0, None)
+    await interaction.response.defer()
 
-    success = [
-        "멋진 오운완 사진", "감성 카페에서 찍은 한 컷", "그냥 외모가 원인",
-        "해시태그 전략이 제대로 먹혔다", "스토리 공유 이벤트 덕분에 떡상"
-    ]
-    fail = [
-        "감성글 썼다가 감성팔이로 오해받음", "무심코 한 말이 트리거", "과한 보정",
-        "정치 얘기 살짝 해버림", "짜증나는 광고같이 보임"
-    ]
-    neutral = [
-        "이상하게 이 사진은 다들 무시함", "알고리즘이 나를 버림", "업로드 시간 실패",
-        "너무 자주 올렸더니 피로감 온 듯", "감성 폭발했는데 나만 느낌"
+    if 전체:
+        target_ids = None
+        target_text = "이 서버에 가입한 모든 유저"
+    elif 역할 is not None:
+        target_ids = [str(member.id) for member in await role_members(역할) if not member.bot]
+        target_text = 역할.mention
+    else:
+        target_ids = list(dict.fromkeys(re.findall(r"\d{15,20}", 유저목록)))  # 멘션/ID에서 숫자만, 중복 제거
+        target_text = f"지정한 유저 {len(target_ids)}명"
+    if target_ids is not None and not target_ids:
+        await interaction.followup.send("❌ 대상 유저가 없습니다.")
+        return
+
+    guild_id = str(interaction.guild_id)
+    store = partition_for(guild_id)
+    try:
+        count = await store.db.add_balance_bulk(guild_id, 변경할금액, target_ids, reason=사유,
+                                                actor_id=str(interaction.user.id))
+    except Exception as e:
+        await interaction.followup.send(f"❌ 잔액 변경 중 오류가 발생했습니다: {e}")
+        return
+    store.users.shift("balance", 변경할금액, guild_id, target_ids)
+    store.leaderboards.invalidate(guild_id)
+
+    embed = nextcord.Embed(
+        title=f"{interaction.user.name}님의 요청",
+        description=f"{target_text}의 잔액 일괄 변경 완료!",
+        color=nextcord.Color(0xF3F781)
+    )
+    embed.add_field(name="1인당 변경 금액", value=f"{변경할금액:,}원", inline=True)
+    embed.add_field(name="변경된 인원", value=f"{count:,}명", inline=True)
+    embed.add_field(name="총 변경 금액", value=f"{변경할금액 * count:,}원", inline=True)
+    if target_ids is not None and count < len(target_ids):
+        embed.add_field(name="제외", value=f"가입하지 않은 {len(target_ids) - count:,}명", inline=False)
+    embed.add_field(name="사유", value=사유, inline=False)
+    await interaction.followup.send(embed=embed)
+
+
+# --- 거래 내역 ---
+@bot.slash_command(name="거래내역", description="잔액 변경 내역을 확인합니다.", dm_permission=False)
+async def 거래내역(
+    interaction: Interaction,
+    유저: nextcord.Member = nextcord.SlashOption(description="다른 유저의 내역은 관리자만 볼 수 있습니다.", required=False),
+    일수: int = nextcord.SlashOption(description="최근 며칠의 내역을 볼지 입력하세요.", required=False, default=7,
+                                   min_value=1, max_value=LEDGER_RETENTION_DAYS)
+):
+    target = 유저 or interaction.user
+    is_admin = interaction.user.guild_permissions.administrator or interaction.guild.owner_id == interaction.user.id
+    if target.id != interaction.user.id and not is_admin:
+        await interaction.response.send_message("다른 유저의 내역은 관리자만 볼 수 있습니다.", ephemeral=True)
+        return
+
+    await interaction.response.defer(ephemeral=True)
+    store, key = storage(interaction, target)
+    user = await store.users.get(key)
+    if user is None:
+        await interaction.followup.send("❌ 가입이 되어있지 않거나 존재하지 않는 유저입니다.")
+        return
+
+    await store.users.flush()  # 아직 저장 안 된 내역까지 포함
+    since = int(time.time()) - 일수 * 24 * 60 * 60
+    history = await store.db.ledger_history(*key, since, 20)
+    ledger_balance = await store.db.ledger_balance(*key)
+
+    # 관리자가 바꾼 내역에는 바꾼 사람 이름을 붙임
+    actors = {}
+    for actor_id in {row[2] for row in history if row[2]}:
+        member = await member_cache.get(interaction.guild, int(actor_id))
+        actors[actor_id] = member.display_name if member is not None else "알 수 없음"
+
+    embed = nextcord.Embed(title=f"🧾 {target.name}님의 거래 내역 (최근 {일수}일)", color=0xF3F781)
+    lines = [
+        f"`{datetime.fromtimestamp(created_at):%m-%d %H:%M}` **{amount:+,}원** · {(reason or '-')[:50]}"
+        + (f" ({actors[actor_id]})" if actor_id else "")
+        for amount, reason, actor_id, created_at in history
     ]
+    embed.description = "\n".join(lines) if lines else "내역이 없습니다."
+    embed.add_field(name="현재 잔액", value=f"{user['balance']:,}원", inline=False)
+    if ledger_balance != user["balance"]:
+        embed.add_field(name="⚠️ 불일치", value=f"원장 기준 잔액은 {ledger_balance:,}원입니다.", inline=False)
+    await interaction.followup.send(embed=embed)
 
-    result_choice = random.choice(["good", "bad", "neutral"])
-
-    if result_choice == "good":
-        origin = random.choice(success)
-        follower += 10
-        like += 30
-        msg = f"📈 알고리즘을 탔습니다!\n(원인: {origin})\n+10 Follower / +30 Like"
-    elif result_choice == "bad":
-        origin = random.choice(fail)
-        follower -= 10
-        hate += 30
-        msg = f"📉 논란의 여지가 있는 사진이네요...\n(원인: {origin})\n-10 Follower / +30 Hate"
-    else:
-        origin = random.choice(neutral)
-        msg = f"😐 이목을 끌지 못했어요..\n(원인: {origin})\n+0 Follower / +0 Like"
 
-    c.execute("""
-        UPDATE users SET follower = ?, like = ?, hate = ?, last_post_time = ?
-        WHERE user_id = ?
-    """, (follower, like, hate, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), user_id))
+# --- 엑셀 내보내기/가져오기 (관리자만) ---
+@bot.slash_command(name="엑셀내보내기", description="유저 데이터를 엑셀 파일로 내보냅니다.", dm_permission=False, default_member_permissions=nextcord.Permissions(administrator=True))
+async def 엑셀내보내기(interaction: Interaction):
+    if not (interaction.user.guild_permissions.administrator or interaction.guild.owner_id == interaction.user.id):
+        await interaction.response.send_message("관리자만 사용할 수 있는 명령어입니다.", ephemeral=True)
+        return
 
-    conn.commit()
-    conn.close()
+    await interaction.response.defer(ephemeral=True)
+    await flush_all()  # 아직 저장 안 된 변경까지 포함
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, f"users_{datetime.now():%Y%m%d_%H%M%S}.xlsx")
+        try:
+            count = await asyncio.to_thread(export_users_xlsx, path, partition_for(interaction.guild_id).path,
+                                            str(interaction.guild_id))
+            await interaction.followup.send(f"✅ 유저 {count:,}명을 내보냈습니다.", file=nextcord.File(path))
+        except Exception as e:
+            await interaction.followup.send(f"❌ 내보내기 중 오류가 발생했습니다: {e}")
+
+
+@bot.slash_command(name="엑셀가져오기", description="엑셀 파일의 유저 데이터를 DB에 넣습니다.", dm_permission=False, default_member_permissions=nextcord.Permissions(administrator=True))
+async def 엑셀가져오기(
+    interaction: Interaction,
+    파일: nextcord.Attachment = nextcord.SlashOption(description="/엑셀내보내기 형식의 .xlsx 파일을 올려주세요.")
+):
+    if not (interaction.user.guild_permissions.administrator or interaction.guild.owner_id == interaction.user.id):
+        await interaction.response.send_message("관리자만 사용할 수 있는 명령어입니다.", ephemeral=True)
+        return
+    if not 파일.filename.lower().endswith(".xlsx"):
+        await interaction.response.send_message("❌ .xlsx 파일만 가져올 수 있습니다.", ephemeral=True)
+        return
+
+    await interaction.response.defer(ephemeral=True)
+    await flush_all()
+
+    guild_id = str(interaction.guild_id)
+    store = partition_for(guild_id)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "import.xlsx")
+        try:
+            await 파일.save(path)
+            count = await store.db.import_users(path, guild_id)
+        except Exception as e:
+            await interaction.followup.send(f"❌ 가져오기 중 오류가 발생했습니다: {e}")
+            return
+
+    store.users.invalidate()
+    store.leaderboards.invalidate(guild_id)
+    await interaction.followup.send(f"✅ 유저 {count:,}명을 가져왔습니다.")
+
+
+# --- 성능 통계 (관리자만) ---
+@bot.slash_command(name="통계", description="명령어별 응답 시간과 이벤트 루프 지연을 확인합니다.", dm_permission=False, default_member_permissions=nextcord.Permissions(administrator=True))
+async def 통계(interaction: Interaction):
+    if not (interaction.user.guild_permissions.administrator or interaction.guild.owner_id == interaction.user.id):
+        await interaction.response.send_message("관리자만 사용할 수 있는 명령어입니다.", ephemeral=True)
+        return
+
+    embed = nextcord.Embed(title="📊 성능 통계", color=0x5DADE2)
+    commands_by_count = sorted(metrics.latency.items(), key=lambda item: item[1].count, reverse=True)
+    for command, histogram in commands_by_count[:20]:
+        db_avg = metrics.db_time[command].sum / histogram.count * 1000
+        api_avg = metrics.api_time[command].sum / histogram.count * 1000
+        embed.add_field(
+            name=f"/{command}",
+            value=(f"{histogram.count:,}회 · 오류 {metrics.errors[command]}회\n"
+                   f"p50 {histogram.quantile(0.5) * 1000:.0f}ms · p99 {histogram.quantile(0.99) * 1000:.0f}ms\n"
+                   f"평균 DB {db_avg:.1f}ms · API {api_avg:.1f}ms"),
+            inline=True
+        )
+    if not commands_by_count:
+        embed.description = "아직 기록된 명령어가 없습니다."
+    embed.add_field(
+        name="⏱️ 이벤트 루프 지연",
+        value=f"p99 {metrics.loop_lag.quantile(0.99) * 1000:.1f}ms · 최대 {metrics.loop_lag_max * 1000:.1f}ms",
+        inline=False
+    )
+    embed.add_field(
+        name="🚦 속도 제한",
+        value=f"거절 {rate_limiter.rejected:,}회 · 버킷 {len(rate_limiter):,}개 · 잠금 {len(user_locks):,}개",
+        inline=False
+    )
+    rss = max_rss_mb()
+    embed.add_field(
+        name="🧠 메모리",
+        value=(f"최대 {f'{rss:.0f}MB' if rss is not None else '알 수 없음'} · 캐시된 멤버 {cached_member_count():,}명\n"
+               f"가져온 멤버 {len(member_cache):,}명 (적중 {member_cache.hits:,} · 조회 {member_cache.misses:,})"),
+        inline=False
+    )
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+
+# --- DB 백업/검사/복원 (관리자만, 복원은 봇 주인만) ---
+@bot.slash_command(name="백업", description="DB를 백업하거나 백업 파일을 검사/복원합니다.", dm_permission=False, default_member_permissions=nextcord.Permissions(administrator=True))
+async def 백업(
+    interaction: Interaction,
+    작업: str = nextcord.SlashOption(description="할 작업을 선택하세요.",
+                                   choices={"지금 백업": "backup", "목록": "list", "검사": "verify", "복원": "restore"}),
+    파일: str = nextcord.SlashOption(description="검사/복원할 백업 파일 이름 (비우면 가장 최근 것)", required=False)
+):
+    if not (interaction.user.guild_permissions.administrator or interaction.guild.owner_id == interaction.user.id):
+        await interaction.response.send_message("관리자만 사용할 수 있는 명령어입니다.", ephemeral=True)
+        return
+    # 한 DB 파일에 여러 서버의 데이터가 있으므로 복원은 봇 주인만
+    if 작업 == "restore" and not await bot.is_owner(interaction.user):
+        await interaction.response.send_message("❌ 복원은 봇 주인만 할 수 있습니다.", ephemeral=True)
+        return
+
+    await interaction.response.defer(ephemeral=True)
+    partition = partition_for(interaction.guild_id)
+    backups = list_backups(partition.path)
+
+    if 작업 == "backup":
+        await flush_all()
+        try:
+            path = await asyncio.to_thread(backup_database, partition.path)
+        except Exception as e:
+            await interaction.followup.send(f"❌ 백업 중 오류가 발생했습니다: {e}")
+            return
+        await interaction.followup.send(f"✅ 백업했습니다: `{os.path.basename(path)}`")
+        return
+    if 작업 == "list":
+        lines = [f"`{name}` ({os.path.getsize(os.path.join(BACKUP_DIR, name)) / 1024:,.0f}KB)"
+                 for name in reversed(backups[-15:])]
+        await interaction.followup.send("\n".join(lines) if lines else "백업이 없습니다.")
+        return
+
+    name = 파일 or (backups[-1] if backups else None)
+    if name not in backups:
+        await interaction.followup.send("❌ 백업 파일을 찾을 수 없습니다. `목록`에서 이름을 확인해주세요.")
+        return
+    path = os.path.join(BACKUP_DIR, name)
+    try:
+        result, version, users = await asyncio.to_thread(verify_backup, path)
+    except Exception as e:
+        await interaction.followup.send(f"❌ `{name}` 검사 중 오류가 발생했습니다: {e}")
+        return
+    if 작업 == "verify" or result != "ok":
+        status = "✅ 정상" if result == "ok" else f"❌ 손상됨: {result[:500]}"
+        await interaction.followup.send(f"`{name}`: {status} · 스키마 {version} · 유저 {users:,}명")
+        return
+
+    try:
+        await restore_backup(partition, path)
+    except Exception as e:
+        await interaction.followup.send(f"❌ 복원 중 오류가 발생했습니다: {e}")
+        return
+    await interaction.followup.send(f"✅ `{name}`으로 복원했습니다. (유저 {users:,}명, 복원 전 상태도 백업해 두었습니다)")
+
+
+# --- 이벤트/게시물 표 다시 불러오기 (관리자만) ---
+@bot.slash_command(name="설정다시불러오기", description="events.json의 이벤트/게시물 결과 표를 다시 불러옵니다.", dm_permission=False, default_member_permissions=nextcord.Permissions(administrator=True))
+async def 설정다시불러오기(interaction: Interaction):
+    global game_config
+    if not (interaction.user.guild_permissions.administrator or interaction.guild.owner_id == interaction.user.id):
+        await interaction.response.send_message("관리자만 사용할 수 있는 명령어입니다.", ephemeral=True)
+        return
+
+    try:
+        config = load_game_config()
+    except (OSError, ValueError) as e:  # json.JSONDecodeError도 ValueError
+        await interaction.response.send_message(f"❌ 불러오지 못했습니다. 기존 설정을 그대로 씁니다.\n{e}", ephemeral=True)
+        return
+    game_config = config
+    await interaction.response.send_message(
+        f"✅ 이벤트 {len(config.events)}개, 게시물 결과 {len(config.posts)}개를 불러왔습니다.", ephemeral=True)
+
+
+# --- 게시물 올리기 (쿨타임 15초) ---
+@bot.slash_command(name="게시물올리기", description="디스타그램에 게시물을 올립니다.", dm_permission=False)
+async def 게시물올리기(
+    interaction: Interaction,
+    내용: str = nextcord.SlashOption(description="게시물 내용 (비우면 게시물 반응 원인으로)", required=False, max_length=200)
+):
+    store, key = storage(interaction)
+    secs_left = store.cooldowns.hit("게시물올리기", key)
+    if secs_left:
+        await interaction.response.send_message(cooldown_message(secs_left), ephemeral=True)
+        return
+
+    user = await store.users.get(key)
+    if user is None:
+        store.cooldowns.reset("게시물올리기", key)
+        await interaction.response.send_message("❗가입하지 않은 사용자입니다.", ephemeral=True)
+        return
+
+    post = game_config.post_sampler.sample()
+    reason = random.choice(post["reasons"])
+    msg = post["message"].format(reason=reason)
+
+    store.users.apply(key, post["deltas"], last_post_time=int(time.time()))
+    await store.timelines.publish(key, user["name"], 내용 or reason)
 
     embed = nextcord.Embed(title="📸 게시물 업로드", description=msg, color=0xff76c3)
     await interaction.response.send_message(embed=embed)
 
 
+# --- 팔로우 ---
+async def change_follow(interaction, 유저, follow):
+    """팔로우/언팔로우 공통 처리. 팔로우 수는 다시 세지 않고 바뀐 만큼만 더하거나 뺍니다."""
+    store, key = storage(interaction)
+    _, target = storage(interaction, 유저)
+    if target == key:
+        await interaction.response.send_message("❗자기 자신은 팔로우할 수 없습니다.", ephemeral=True)
+        return
+    if await store.users.get(key) is None:
+        await interaction.response.send_message("❗가입하지 않은 사용자입니다.", ephemeral=True)
+        return
+    if await store.users.get(target) is None:
+        await interaction.response.send_message(f"❗{유저.mention}님은 가입하지 않은 사용자입니다.", ephemeral=True)
+        return
+
+    if not await store.db.set_follow(*key, target[1], follow):
+        state = "이미 팔로우하고 있습니다" if follow else "팔로우하고 있지 않습니다"
+        await interaction.response.send_message(f"{유저.mention}님을 {state}.", ephemeral=True)
+        return
+
+    step = 1 if follow else -1
+    store.users.apply(key, {"following": step})
+    store.users.apply(target, {"follower": step})
+    store.timelines.invalidate(key)  # 상대 글이 들어오거나 빠지도록 다음 조회 때 다시 만듦
+    action = "팔로우했습니다" if follow else "언팔로우했습니다"
+    await interaction.response.send_message(f"✅ {유저.mention}님을 {action}.", ephemeral=True)
+
+
+@bot.slash_command(name="팔로우", description="유저를 팔로우하고 타임라인에서 게시물을 받아봅니다.", dm_permission=False)
+async def 팔로우(
+    interaction: Interaction,
+    유저: nextcord.Member = nextcord.SlashOption(description="팔로우할 유저")
+):
+    await change_follow(interaction, 유저, True)
+
+
+@bot.slash_command(name="언팔로우", description="유저 팔로우를 취소합니다.", dm_permission=False)
+async def 언팔로우(
+    interaction: Interaction,
+    유저: nextcord.Member = nextcord.SlashOption(description="언팔로우할 유저")
+):
+    await change_follow(interaction, 유저, False)
+
+
+@bot.slash_command(name="타임라인", description="내가 팔로우한 사람들의 최근 게시물을 확인합니다.", dm_permission=False)
+async def 타임라인(interaction: Interaction):
+    store, key = storage(interaction)
+    if await store.users.get(key) is None:
+        await interaction.response.send_message("❗가입하지 않은 사용자입니다.", ephemeral=True)
+        return
+
+    posts = await store.timelines.get(key, TIMELINE_PAGE_SIZE)
+    embed = nextcord.Embed(title="🗞️ 타임라인", color=0x7ec8ff)
+    if not posts:
+        embed.description = "아직 게시물이 없습니다. /팔로우 로 다른 유저를 팔로우해 보세요!"
+    for _, _, name, content, created_at in posts:
+        embed.add_field(name=f"{name} · <t:{created_at}:R>", value=content, inline=False)
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+
 # --- 내피드 확인 (쿨타임 10초) ---
-@bot.slash_command(name="내피드", description="자신의 디스타그램 피드를 확인합니다.")
+@bot.slash_command(name="내피드", description="자신의 디스타그램 피드를 확인합니다.", dm_permission=False)
 async def 내피드(interaction: Interaction):
+    store, key = storage(interaction)
+    secs_left = store.cooldowns.hit("내피드", key)
+    if secs_left:
+        await interaction.response.send_message(cooldown_message(secs_left), ephemeral=True)
+        return
+
     await interaction.response.defer()  # 응답 지연 방지
-    user_id = str(interaction.user.id)
 
-    if not user_exists(user_id):
+    user = await store.users.get(key)
+    if user is None:
+        store.cooldowns.reset("내피드", key)
         await interaction.followup.send("❗가입하지 않은 사용자입니다.", ephemeral=True)
         return
 
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("SELECT name, follower, following, like, hate, last_feed_time FROM users WHERE user_id = ?", (user_id,))
-    result = c.fetchone()
-    conn.close()
+    name, follower, following, like, hate = (
+        user["name"], user["follower"], user["following"], user["like"], user["hate"]
+    )
 
-    if result is None:
-        await interaction.followup.send("❗가입된 유저 정보가 없습니다.", ephemeral=True)
-        return
-
-    name, follower, following, like, hate, last_feed_time = result
-
-    # 칭호 설정
-    if follower >= 10000:
-        title = "🎤 연예인"
-    elif follower >= 5000:
-        title = "🌟 인플루언서"
-    elif follower >= 1000:
-        title = "🔥 라이징스타"
-    elif hate >= 10000:
-        title = "💀 혐오유발자"
-    elif hate >= 5000:
-        title = "🦇 다크나이트"
-    elif hate >= 1000:
-        title = "💢 불행전달자"
-    else:
-        title = "👤 일반인"
+    title = feed_title(user)
 
     embed = nextcord.Embed(title="📱 내 디스타그램 피드", color=0xbf74fd)
     embed.add_field(name="이름", value=name, inline=False)
@@ -437,100 +3053,64 @@ async def 내피드(interaction: Interaction):
 
 
 # --- 랜덤 이벤트 발생 (쿨타임 15분) ---
-@bot.slash_command(name="이벤트", description="랜덤 이벤트가 발생합니다(쿨타임 : 5분)")
+@bot.slash_command(name="이벤트", description="랜덤 이벤트가 발생합니다(쿨타임 : 5분)", dm_permission=False)
 async def 이벤트(interaction: Interaction):
-    user_id = str(interaction.user.id)
-    if not user_exists(user_id):
-        await interaction.response.send_message("❗가입하지 않은 사용자입니다.", ephemeral=True)
+    store, key = storage(interaction)
+    secs_left = store.cooldowns.hit("이벤트", key)
+    if secs_left:
+        await interaction.response.send_message(cooldown_message(secs_left), ephemeral=True)
         return
 
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("SELECT follower, following, like, hate, last_event_time FROM users WHERE user_id = ?", (user_id,))
-    result = c.fetchone()
-    follower, following, like, hate, last_event_time = result
-
-    on_cd, secs_left = is_on_cooldown(last_event_time, 5)
-    if on_cd:
-        mins = secs_left // 60
-        secs = secs_left % 60
-        await interaction.response.send_message(f"⏳ 쿨타임입니다. {mins}분 {secs}초 후에 다시 시도해주세요.", ephemeral=True)
-        conn.close()
+    user = await store.users.get(key)
+    if user is None:
+        store.cooldowns.reset("이벤트", key)
+        await interaction.response.send_message("❗가입하지 않은 사용자입니다.", ephemeral=True)
         return
 
-    events = [
-        ("📺 방송에 출연했어요!", 1000, 0, 1000, 0, 0.1),
-        ("💸 팔로워 구매에 홀렸어요...", 200, 0, 0, 100, 5),
-        ("🔓 해킹을 당했어요 (팔로잉)", -50, 200, 100, 0, 5),
-        ("📈 릴스가 떡상했어요!", 100, 0, 500, 0, 10),
-        ("❌ 해킹을 당했어요 (계정)", -follower, -following, -like, -hate, 0.1),
-        ("🏢 기획사에 들어갔어요!", 500, 0, 500, 0, 0.4),
-        ("🧹 팔로잉을 정리했어요!", 0, -100, 0, 50, 0.4),
-        ("🗯️ 혐오발언을 했어요...", -200, 0, 0, 500, 4.5),
-        ("❤️ 기부 사진을 올렸어요!", 200, 0, 1000, 0, 4.5),
-        ("📶 소소한 오름", 1, 0, 1, 0, 45),
-        ("💤 아무 일도 없었어요", 0, 0, 0, 0, 45),
-    ]
-
-    weights = [e[5] for e in events]
-    selected = random.choices(events, weights=weights, k=1)[0]
-    name, f_change, fg_change, l_change, h_change, _ = selected
-
-    if name == "❌ 해킹을 당했어요 (계정)":
-        follower, following, like, hate = 0, 0, 0, 0
+    event = game_config.event_sampler.sample()
+    if event["reset"]:
+        # 스탯을 전부 0으로
+        deltas = {col: -(user[col] or 0) for col in GAME_STATS}
     else:
-        follower += f_change
-        following += fg_change
-        like += l_change
-        hate += h_change
-
-    c.execute("""
-        UPDATE users SET follower = ?, following = ?, like = ?, hate = ?, last_event_time = ?
-        WHERE user_id = ?
-    """, (follower, following, like, hate, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), user_id))
-
-    conn.commit()
-    conn.close()
+        deltas = event["deltas"]
+    store.users.apply(key, deltas, last_event_time=int(time.time()))
 
-    embed = nextcord.Embed(title="🎲 이벤트 발생!", description=name, color=0xffdf7c)
-    if name == "💤 아무 일도 없었어요":
-        embed.add_field(name="🥱", value="정말 아무 일도 없었어요...", inline=False)
+    embed = nextcord.Embed(title="🎲 이벤트 발생!", description=event["name"], color=0xffdf7c)
+    if event["quiet"]:
+        embed.add_field(name="🥱", value=event["quiet"], inline=False)
     else:
         embed.add_field(name="📊 변화량", value=(
-            f"📈 팔로워: {f_change:+}\n"
-            f"📉 팔로잉: {fg_change:+}\n"
-            f"❤️ 좋아요: {l_change:+}\n"
-            f"💔 싫어요: {h_change:+}"
+            f"📈 팔로워: {deltas.get('follower', 0):+}\n"
+            f"📉 팔로잉: {deltas.get('following', 0):+}\n"
+            f"❤️ 좋아요: {deltas.get('like', 0):+}\n"
+            f"💔 싫어요: {deltas.get('hate', 0):+}"
         ), inline=False)
 
     await interaction.response.send_message(embed=embed)
 
 
-@bot.slash_command(name="익명", description="익명으로 메시지를 보냅니다.")
+@bot.slash_command(name="익명", description="익명으로 메시지를 보냅니다.", dm_permission=False)
 async def 익명(interaction: nextcord.Interaction, *, 내용: str):
-    # 익명 메시지 전송 (박스 스타일)
-    await interaction.channel.send(f"🗣️ **익명 메시지:**\n```{내용}```")
-
-    # 로그 채널 가져오기
-    log_channel = bot.get_channel(1383790330926858341)  # 숫자형 ID
-    if log_channel:
-        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        nickname = interaction.user.nick if interaction.user.nick else interaction.user.name
-        user_id = interaction.user.id
-
-        # 임베드 만들기
-        embed = nextcord.Embed(title="🗒️ 익명 메시지 로그", color=0x888888)
-        embed.add_field(name="보낸 시각", value=f"`{now}`", inline=False)
-        embed.add_field(name="닉네임", value=f"`{nickname}`", inline=True)
-        embed.add_field(name="유저 ID", value=f"`{user_id}`", inline=True)
-        embed.add_field(name="내용", value=f"```{내용}```", inline=False)
-        embed.set_footer(text="익명 시스템 로그")
-
-        await log_channel.send(embed=embed)
-
-    # 사용자에게 응답 (자신만 보기)
+    # 사용자에게 먼저 응답 (자신만 보기)
     await interaction.response.send_message("✅ 익명 메시지가 전송되었습니다.", ephemeral=True)
 
+    # 익명 메시지 전송 (박스 스타일)
+    try:
+        await interaction.channel.send(f"🗣️ **익명 메시지:**\n```{내용}```")
+    except nextcord.HTTPException as e:
+        await interaction.followup.send(f"❌ 익명 메시지 전송 중 오류가 발생했습니다: {e}", ephemeral=True)
+        return
+
+    # 로그는 큐에 넣어 두면 백그라운드에서 모아서 전송
+    anonymous_logs.put({
+        "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "nickname": interaction.user.nick if interaction.user.nick else interaction.user.name,
+        "user_id": interaction.user.id,
+        "guild_id": interaction.guild_id,
+        "channel_id": interaction.channel_id,
+        "content": 내용,
+    })
+
 
 # --- 닉네임 변경 명령어 ---
 @bot.command(name="닉네임변경")
@@ -548,41 +3128,184 @@ async def 닉네임변경(ctx, *, 새_닉네임: str):
         await ctx.send(f"❌ 닉네임 변경 중 오류가 발생했습니다: {e}")
 
 
-@bot.command(name="수빈")
-async def 수빈(ctx):
-    await ctx.send("서버 내 최강 미녀")
+# --- 자동응답 (!트리거) ---
+# 트리거별 답변을 DB에서 읽어 {guild_id: {트리거: AliasSampler}} 로 들고 있다가 on_message에서 dict 조회 두 번으로 찾습니다.
+# 관리자가 /자동응답 으로 고치면 그 서버 것만 다시 읽으므로 재시작이 필요 없습니다.
+# 모든 서버 공통(guild_id = '') 답변은 0번 파티션(data.db)의 것을 씁니다.
+class CustomReplies:
+    def __init__(self):
+        self._guilds = {}  # guild_id -> {트리거: AliasSampler(답변)}
+
+    @staticmethod
+    def _build(rows):
+        grouped = defaultdict(lambda: defaultdict(list))
+        for guild_id, trigger, reply, weight in rows:
+            grouped[guild_id][trigger].append((reply, weight))
+        return {
+            guild_id: {trigger: AliasSampler([r for r, _ in replies], [w for _, w in replies])
+                       for trigger, replies in triggers.items()}
+            for guild_id, triggers in grouped.items()
+        }
+
+    @staticmethod
+    def _owned(partition, rows):
+        return [row for row in rows if row[0] != "" or partition is partitions[0]]
+
+    def load(self):
+        """시작할 때 모든 파티션의 자동응답을 읽습니다."""
+        rows = []
+        for partition in partitions:
+            rows += self._owned(partition, partition.db.call_sync(lambda conn: conn.execute(
+                "SELECT guild_id, trigger, reply, weight FROM custom_replies").fetchall()))
+        self._guilds = self._build(rows)
+
+    async def reload(self, guild_id=None):
+        """guild_id 서버(None이면 전부)의 자동응답을 DB에서 다시 읽습니다."""
+        if guild_id is None:
+            rows = []
+            for partition in partitions:
+                rows += self._owned(partition, await partition.db.custom_replies())
+            self._guilds = self._build(rows)
+            return
+        partition = partitions[0] if guild_id == "" else partition_for(guild_id)
+        built = self._build(await partition.db.custom_replies(guild_id))
+        self._guilds[guild_id] = built.get(guild_id, {})
+
+    def lookup(self, guild_id, trigger):
+        """trigger의 답변 하나를 가중치대로 뽑습니다. 서버 것이 공통 것보다 우선, 없으면 None"""
+        sampler = self._guilds.get(guild_id, {}).get(trigger) or self._guilds.get("", {}).get(trigger)
+        return sampler.sample() if sampler is not None else None
+
+    def triggers(self, guild_id):
+        """{트리거: (답변 수, 공통 여부)}"""
+        merged = {trigger: (len(s.items), True) for trigger, s in self._guilds.get("", {}).items()}
+        merged.update({trigger: (len(s.items), False) for trigger, s in self._guilds.get(guild_id, {}).items()})
+        return merged
+
+
+custom_replies = CustomReplies()
+
 
-@bot.command(name="인천나얼")
-async def 인천나얼(ctx):
-    await ctx.send("서버 내 핵심인재")
+@bot.event
+async def on_message(message):
+    if message.author.bot:
+        return
+    prefix = bot.command_prefix
+    if message.content.startswith(prefix):
+        words = message.content[len(prefix):].split(maxsplit=1)
+        guild_id = str(message.guild.id) if message.guild else ""  # DM에서는 공통 자동응답만
+        reply = custom_replies.lookup(guild_id, words[0]) if words else None
+        if reply is not None:
+            await message.channel.send(reply)
+            return
+    await bot.process_commands(message)
+
+
+@bot.slash_command(name="자동응답", description="!트리거 로 답하는 자동응답을 추가/삭제하거나 목록을 봅니다.", dm_permission=False, default_member_permissions=nextcord.Permissions(administrator=True))
+async def 자동응답(
+    interaction: Interaction,
+    작업: str = nextcord.SlashOption(description="할 작업을 선택하세요.", choices={"추가": "add", "삭제": "delete", "목록": "list"}),
+    트리거: str = nextcord.SlashOption(description="! 뒤에 붙일 단어 (예: 어서오세요)", required=False, max_length=50),
+    답변: str = nextcord.SlashOption(description="보낼 답변 (삭제할 때 비우면 트리거 전체)", required=False, max_length=2000),
+    가중치: float = nextcord.SlashOption(description="답변이 여러 개일 때 뽑힐 비율 (기본 1)", required=False, min_value=0.01, default=1),
+    전체서버: bool = nextcord.SlashOption(description="모든 서버 공통 자동응답 (봇 주인만)", required=False, default=False)
+):
+    if not (interaction.user.guild_permissions.administrator or interaction.guild.owner_id == interaction.user.id):
+        await interaction.response.send_message("관리자만 사용할 수 있는 명령어입니다.", ephemeral=True)
+        return
+    if 전체서버 and not await bot.is_owner(interaction.user):
+        await interaction.response.send_message("❌ 모든 서버 공통 자동응답은 봇 주인만 바꿀 수 있습니다.", ephemeral=True)
+        return
+    guild_id = "" if 전체서버 else str(interaction.guild_id)
 
-@bot.command(name="레인")
-async def 레인(ctx):
-    await ctx.send("레인공쥬등장")
+    if 작업 == "list":
+        triggers = custom_replies.triggers(str(interaction.guild_id))
+        lines = [f"`!{trigger}` 답변 {count}개" + (" (공통)" if shared else "")
+                 for trigger, (count, shared) in sorted(triggers.items())]
+        await interaction.response.send_message("\n".join(lines) if lines else "자동응답이 없습니다.", ephemeral=True)
+        return
 
-@bot.command(name="봄")
-async def 봄(ctx):
-    await ctx.send('봄이는 수비니를 조아해')
+    트리거 = (트리거 or "").strip()
+    if not 트리거 or len(트리거.split()) != 1:
+        await interaction.response.send_message("❌ 트리거는 띄어쓰기 없는 한 단어로 입력해주세요.", ephemeral=True)
+        return
+    if 트리거 in bot.all_commands:
+        await interaction.response.send_message(f"❌ `!{트리거}`는 이미 있는 명령어입니다.", ephemeral=True)
+        return
 
-@bot.command(name="어서오세요")
-async def 어서오세요(ctx):
-    ran = random.randint(0, 3)
-    if ran == 0:
-        r = "반가워요"
-    elif ran == 1:
-        r = "환영해요"
-    elif ran == 2:
-        r = "음챗해요"
+    store = partitions[0] if 전체서버 else partition_for(interaction.guild_id)
+    if 작업 == "add":
+        if not 답변:
+            await interaction.response.send_message("❌ 추가할 답변을 입력해주세요.", ephemeral=True)
+            return
+        await store.db.set_custom_reply(guild_id, 트리거, 답변, 가중치)
+        message = f"✅ `!{트리거}`에 답변을 추가했습니다. (가중치 {가중치:g})"
     else:
-        r = "게임해요"
-    await ctx.channel.send(r)
+        deleted = await store.db.delete_custom_reply(guild_id, 트리거, 답변)
+        if not deleted:
+            await interaction.response.send_message("❌ 지울 자동응답을 찾을 수 없습니다.", ephemeral=True)
+            return
+        message = f"✅ `!{트리거}`의 답변 {deleted}개를 지웠습니다."
+
+    await custom_replies.reload(guild_id)
+    await interaction.response.send_message(message, ephemeral=True)
+
+
+# --- 슬래시 명령어 동기화 ---
+# 명령어 정의(이름, 설명, 옵션, 권한)의 해시를 파일에 남겨 두고, 바뀌지 않았으면 디스코드에 다시 등록하지 않습니다.
+# 건너뛰어도 nextcord가 처음 호출될 때 이름으로 명령어를 찾아 연결합니다.
+def command_hash():
+    payloads = sorted((cmd.get_payload(None) for cmd in bot.get_all_application_commands() if cmd.is_global),
+                      key=lambda payload: (payload["type"], payload["name"]))
+    data = json.dumps({"application": bot.user.id, "commands": payloads},
+                      ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def read_command_hash():
+    try:
+        with open(COMMAND_HASH_FILE, encoding="utf-8") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+@bot.event
+async def on_connect():
+    # nextcord 기본 on_connect를 대신함 (명령어 추가 + 매번 전체 동기화)
+    startup_step("로그인")
+    bot.add_all_application_commands()
+    current = command_hash()
+    if os.getenv("SYNC_COMMANDS") != "1" and read_command_hash() == current:
+        startup_step("명령어 동기화")
+        print("슬래시 명령어가 바뀌지 않아 동기화를 건너뜁니다.")
+        return
+    # 디스코드에 등록된 목록과 비교해 바뀐 명령어만 수정/추가/삭제됨
+    await bot.sync_application_commands(guild_id=None)
+    with open(COMMAND_HASH_FILE, "w", encoding="utf-8") as f:
+        f.write(current)
+    startup_step("명령어 동기화")
+    print("슬래시 명령어를 디스코드에 동기화했습니다.")
 
 
 @bot.event
 async def on_ready():
+    first_ready = not background_tasks  # on_ready는 재연결 때마다 다시 호출됨
+    startup_step("on_ready")
+    await adopt_legacy_data()
+    start_background_tasks()
     print(f'We have logged in as {bot.user}')
+    if first_ready:
+        print(startup_report())
     print("등록된 명령어 목록:", [cmd.name for cmd in bot.commands])
 
 
-init_db()
-bot.run(Token)
+if __name__ == "__main__":
+    startup_step("모듈")
+    init_storage()
+    startup_step("init_db")
+    try:
+        bot.run(Token)
+    finally:
+        asyncio.run(flush_all())  # 종료 전 남은 변경 저장
+        close_storage()